@@ -23,6 +23,34 @@ DATABASES = {
     }
 }
 
+# Rendered plots are kept in the 'plots' cache, in local memory by default.
+# Use the commented out settings instead to keep them on disk, shared between
+# worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'plots': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dice-plots',
+        # 'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        # 'LOCATION': '/var/tmp/dice-plots',
+        'TIMEOUT': 24*60*60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+# Worker processes rendering PNG plots, 0 to render in the request thread.
+# The workers and limits are per process, so serve the site from a single
+# threaded process, see dice_probability.render.
+PLOT_WORKERS = 2
+# Plots queued or being rendered at once before requests get a 503.
+PLOT_MAX_PENDING = 8
+# Seconds to wait for a plot before responding with a 503.
+PLOT_TIMEOUT = 10
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -91,6 +119,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'dice_probability.timing.TimingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -4,3 +4,9 @@ urlpatterns = patterns('dice_probability.views',
   url(r'^$', 'probability_reference', name='ref'),
   url(r'^plot.png$', 'probability_reference_plot', name='ref-plot'),
 )
+
+urlpatterns += patterns('dice_probability.api',
+  url(r'^api/$', 'distribution', name='api'),
+  url(r'^api/batch/$', 'batch', name='api-batch'),
+  url(r'^api/stats/$', 'stats', name='api-stats'),
+)
@@ -0,0 +1,248 @@
+"""
+JSON interface to the probability reference, for clients that do their own
+rendering. Accepts the same dice pool and custom dice parameters as the
+HTML pages.
+"""
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+
+from dice_probability.die import LazyDie as Die
+from dice_probability.die import DieParseException, from_string
+from dice_probability.die import collapse_many, versus_matrix
+from dice_probability.die import collapse_cache, duplicate_cache, parse_cache
+from dice_probability.die import BOX_PERCENTILES
+from dice_probability import render
+from dice_probability import timing
+from dice_probability.views import CustomDieFormManager, PoolDieForm
+from dice_probability.views import build_dice
+
+import base64
+import json
+import numpy as np
+
+# The percentiles of the box plots.
+DEFAULT_PERCENTILES = list(BOX_PERCENTILES)
+
+# Limits for each expression in a batch, the same as for a custom die.
+BATCH_MAX_SIDES = 30
+BATCH_MAX_DICE = 15
+
+# Maximum number of expressions in a batch.
+BATCH_MAX_EXPRESSIONS = 1000
+
+def encode_array(data,encoding):
+  """
+  Encode a sequence of floats for JSON, either as a list or as a base64
+  string of little endian float32 values.
+  """
+  if encoding == 'base64':
+    return base64.b64encode(np.asarray(data,dtype='<f4').tostring())
+  return [ float(x) for x in data ]
+
+def encode_matrix(data,encoding):
+  """Encode a matrix row by row, see encode_array()."""
+  return [ encode_array(row,encoding) for row in data ]
+
+def read_percentiles(raw):
+  """Read a comma separated list of percentiles, the default if empty."""
+  if not raw:
+    return DEFAULT_PERCENTILES
+
+  percentiles = [ float(p) for p in raw.split(',') ]
+  # Written to also reject nan, which is not valid JSON.
+  if not all(0.0 <= p <= 1.0 for p in percentiles):
+    raise ValueError("Percentile must be in [0.0, 1.0]")
+  return percentiles
+
+def read_epsilon(raw):
+  """Read the probability dice may be pruned with, 0.0 if empty."""
+  if not raw:
+    return 0.0
+
+  epsilon = float(raw)
+  if not 0.0 <= epsilon < 1.0:
+    raise ValueError("Epsilon must be in [0.0, 1.0)")
+  return epsilon
+
+def json_response(data,status=200):
+  return HttpResponse(
+    json.dumps(data,separators=(',',':')),
+    content_type='application/json',
+    status=status)
+
+def form_errors(customdiemanager,poolform):
+  """Collect the validation errors of all forms, by field name."""
+  errors = {}
+  for f in [poolform] + customdiemanager.base_forms():
+    for (field,messages) in f.errors.items():
+      errors[f.add_prefix(field)] = [ unicode(m) for m in messages ]
+  return errors
+
+def describe_dice(dice,percentiles,encoding):
+  """Describe the distribution of each die."""
+  return [
+    {
+      'name': d.pri,
+      'details': d.details,
+      'probability': encode_array(d.die.probability_array(),encoding),
+      'reach': encode_array(d.die.probability_reach_array(),encoding),
+      'percentiles': d.die.percentile_reach(percentiles),
+      'dropped': d.die.error(),
+    }
+    for d in dice
+  ]
+
+def describe_versus(dice,encoding):
+  """Describe the outcome of each die against each other die."""
+  with timing.phase('versus'):
+    (win,tie,loss) = versus_matrix([ d.die for d in dice ])
+  return {
+    'win': encode_matrix(win,encoding),
+    'tie': encode_matrix(tie,encoding),
+    'loss': encode_matrix(loss,encoding),
+  }
+
+def distribution(request):
+  """
+  Describe the dice given by the dice_pools and <n>-die parameters as JSON.
+
+  Optional parameters:
+    percentiles:  Comma separated percentiles to compute the target values
+                  for. By default 0.95,0.75,0.5,0.25,0.05.
+    encoding:     'list' for lists of numbers, the default, or 'base64' for
+                  base64 encoded little endian float32 arrays.
+    versus:       '0' to leave out the versus matrices.
+    epsilon:      Prune the dice, dropping outcomes with a total probability
+                  of at most epsilon each time dice are summed, see
+                  Die.prune(). The dropped probability of each die is given
+                  as dropped. By default nothing is dropped.
+  """
+  encoding = request.GET.get('encoding','list')
+  if encoding not in ('list','base64'):
+    return HttpResponseBadRequest("Invalid encoding.")
+
+  try:
+    percentiles = read_percentiles(request.GET.get('percentiles'))
+  except ValueError:
+    return HttpResponseBadRequest("Invalid percentiles.")
+
+  try:
+    epsilon = read_epsilon(request.GET.get('epsilon'))
+  except ValueError:
+    return HttpResponseBadRequest("Invalid epsilon.")
+
+  customdiemanager = CustomDieFormManager(request.GET)
+  for i, f in enumerate(customdiemanager.base_forms(),1):
+    f.num = i
+  poolform = PoolDieForm(request.GET)
+
+  if not (customdiemanager.is_valid() and poolform.is_valid()):
+    return json_response(
+      {'errors': form_errors(customdiemanager,poolform)}, status=400)
+
+  dice = build_dice(customdiemanager,poolform)
+  for d in dice:
+    d.die = d.die.prune(epsilon)
+
+  result = {
+    'encoding': encoding,
+    'percentiles': percentiles,
+    'dice': describe_dice(dice,percentiles,encoding),
+  }
+  if request.GET.get('versus','1') != '0':
+    result['versus'] = describe_versus(dice,encoding)
+
+  return json_response(result)
+
+def read_expressions(request):
+  """
+  Read the expressions of a batch request, either from repeated expression
+  GET parameters or from a POSTed JSON object with an expressions list.
+  """
+  if request.method == 'POST':
+    data = json.loads(request.body)
+    expressions = data['expressions']
+    if (type(expressions) is not list
+        or not all(isinstance(e,basestring) for e in expressions)):
+      raise ValueError("Expressions must be a list of strings.")
+    return expressions
+  return request.GET.getlist('expression')
+
+@csrf_exempt
+def batch(request):
+  """
+  Evaluate many custom dice expressions in one request. Expressions
+  describing the same dice are evaluated once, and each duplication of a
+  base die is computed once for the whole batch.
+
+  The expressions are given as repeated expression parameters or POSTed as
+  a JSON object {"expressions": [...]}. The percentiles, encoding and
+  epsilon parameters are the same as for distribution().
+  """
+  encoding = request.GET.get('encoding','list')
+  if encoding not in ('list','base64'):
+    return HttpResponseBadRequest("Invalid encoding.")
+
+  try:
+    percentiles = read_percentiles(request.GET.get('percentiles'))
+  except ValueError:
+    return HttpResponseBadRequest("Invalid percentiles.")
+
+  try:
+    epsilon = read_epsilon(request.GET.get('epsilon'))
+  except ValueError:
+    return HttpResponseBadRequest("Invalid epsilon.")
+
+  try:
+    expressions = read_expressions(request)
+  except (ValueError,KeyError,TypeError):
+    return HttpResponseBadRequest("Invalid expressions.")
+  if len(expressions) > BATCH_MAX_EXPRESSIONS:
+    return HttpResponseBadRequest(
+      "Max %d expressions in a batch."%BATCH_MAX_EXPRESSIONS)
+
+  results = []
+  dice = []
+  for raw in expressions:
+    try:
+      (d,rawdice) = from_string(Die, raw,
+        max_sides=BATCH_MAX_SIDES, max_dice=BATCH_MAX_DICE)
+    except DieParseException as e:
+      results.append({'expression': raw, 'error': e.args[0]})
+      continue
+    if d is None:
+      results.append({'expression': raw, 'error': "Empty expression."})
+      continue
+
+    results.append({'expression': raw, 'canonical': d.canonical()})
+    dice.append(d.prune(epsilon))
+
+  collapsed = iter(collapse_many(dice))
+  for r in results:
+    if 'error' in r:
+      continue
+    d = next(collapsed)
+    r['probability'] = encode_array(d.probability_array(),encoding)
+    r['reach'] = encode_array(d.probability_reach_array(),encoding)
+    r['percentiles'] = d.percentile_reach(percentiles)
+    r['dropped'] = d.error()
+
+  return json_response({
+    'encoding': encoding,
+    'percentiles': percentiles,
+    'results': results,
+  })
+
+def stats(request):
+  """
+  Describe the timings of the requests served by this process, the caches
+  and the render pool as JSON.
+  """
+  result = timing.stats.data()
+  result['caches'] = {
+    'collapse': collapse_cache.stats(),
+    'duplicate': duplicate_cache.stats(),
+    'parse': parse_cache.stats(),
+  }
+  result['render'] = render.pool().stats()
+  return json_response(result)
@@ -0,0 +1,137 @@
+from dice_probability.api import BATCH_MAX_EXPRESSIONS, read_percentiles
+from dice_probability.die import Die, collapse_cache
+from django.test import TestCase
+
+import base64
+import json
+import numpy as np
+
+class TestApi(TestCase):
+  def get(self,query):
+    response = self.client.get('/api/',query)
+    self.assertEquals(response['Content-Type'],'application/json')
+    return (response.status_code,json.loads(response.content))
+
+  def test_list(self):
+    (status,data) = self.get({'0-die':'2d4','percentiles':'0.5'})
+    self.assertEquals(status,200)
+    self.assertEquals(data['encoding'],'list')
+    self.assertEquals(data['percentiles'],[0.5])
+
+    [die] = data['dice']
+    self.assertEquals(die['name'],'Custom 1')
+    self.assertEquals(die['probability'],
+      [0.0,0.0,1/16.,2/16.,3/16.,4/16.,3/16.,2/16.,1/16.])
+    self.assertEquals(die['reach'][:4],[1.0,1.0,1.0,15/16.])
+    self.assertEquals(die['percentiles'],
+      Die(4).duplicate(2).percentile_reach([0.5]))
+    self.assertEquals(die['dropped'],0.0)
+
+  def test_base64(self):
+    query = {'0-die':'2d4','dice_pools':'1'}
+    (status,listed) = self.get(query)
+    query['encoding'] = 'base64'
+    (status,encoded) = self.get(query)
+    self.assertEquals(status,200)
+    self.assertEquals(encoded['encoding'],'base64')
+
+    for (l,e) in zip(listed['dice'],encoded['dice']):
+      for field in ('probability','reach'):
+        decoded = np.frombuffer(base64.b64decode(e[field]),dtype='<f4')
+        self.assertEquals(decoded.tolist(),
+          np.asarray(l[field],dtype='<f4').tolist())
+
+  def test_versus(self):
+    (status,data) = self.get({'0-die':'d6','1-die':'d8'})
+    versus = data['versus']
+    self.assertEquals(len(versus['win']),2)
+    for (a,b) in [(0,0),(0,1),(1,0),(1,1)]:
+      self.assertAlmostEqual(
+        versus['win'][a][b]+versus['tie'][a][b]+versus['loss'][a][b],1.0)
+    self.assertAlmostEqual(versus['tie'][0][0],1/6.)
+    self.assertAlmostEqual(versus['win'][0][1],versus['loss'][1][0])
+
+    (status,data) = self.get({'0-die':'d6','versus':'0'})
+    self.assertFalse('versus' in data)
+
+  def test_errors(self):
+    (status,data) = self.get({'0-die':'d31','dice_pools':'x'})
+    self.assertEquals(status,400)
+    self.assertEquals(sorted(data['errors']),['0-die','dice_pools'])
+
+    for query in ({'percentiles':'nan'},{'percentiles':'1.5'},
+                  {'encoding':'xml'},{'epsilon':'nan'}):
+      self.assertEquals(self.client.get('/api/',query).status_code,400)
+    self.assertRaises(ValueError,read_percentiles,'0.5,inf')
+
+  def test_api_epsilon(self):
+    query = {'0-die':'15d30','versus':'0'}
+    full = json.loads(self.client.get('/api/',query).content)['dice'][0]
+    query['epsilon'] = '1e-9'
+    pruned = json.loads(self.client.get('/api/',query).content)['dice'][0]
+
+    self.assertEquals(full['dropped'],0.0)
+    self.assertTrue(0.0 < pruned['dropped'] < 1e-7)
+    self.assertTrue(len(pruned['probability']) < len(full['probability']))
+
+    query['epsilon'] = '2'
+    self.assertEquals(self.client.get('/api/',query).status_code,400)
+
+  def post_batch(self,body,query=''):
+    return self.client.post('/api/batch/'+query,body,
+      content_type='application/json')
+
+  def test_batch(self):
+    collapse_cache.clear()
+    response = self.client.get('/api/batch/',
+      {'expression':['3d6','d6 2d6','d31','',' '],'percentiles':'0.5'})
+    self.assertEquals(response.status_code,200)
+    data = json.loads(response.content)
+    self.assertEquals(data['percentiles'],[0.5])
+
+    [a,b,invalid,empty,blank] = data['results']
+    self.assertEquals((a['expression'],a['canonical']),('3d6','3d6'))
+    self.assertEquals((b['expression'],b['canonical']),('d6 2d6','3d6'))
+    self.assertEquals(a['probability'],b['probability'])
+    self.assertEquals(a['probability'],Die(6).duplicate(3).probability())
+    self.assertEquals(a['percentiles'],b['percentiles'])
+    self.assertEquals(a['dropped'],0.0)
+    self.assertFalse('error' in a)
+    self.assertEquals(invalid,
+      {'expression':'d31','error':"Max 30 sides for a die"})
+    self.assertEquals(empty,{'expression':'','error':"Empty expression."})
+    self.assertEquals(blank['error'],"Empty expression.")
+
+    # Equivalent expressions are collapsed once.
+    stats = collapse_cache.stats()
+    self.assertEquals((stats['hits'],stats['misses']),(0,1))
+
+  def test_batch_post(self):
+    response = self.post_batch(
+      json.dumps({'expressions':['2d4','[1,1]']}),'?encoding=base64')
+    self.assertEquals(response.status_code,200)
+    data = json.loads(response.content)
+    self.assertEquals(data['encoding'],'base64')
+    [a,b] = data['results']
+    self.assertEquals(a['canonical'],'2d4')
+    self.assertEquals(b['canonical'],'[1,1]')
+    decoded = np.frombuffer(base64.b64decode(b['probability']),dtype='<f4')
+    self.assertEquals(decoded.tolist(),[0.5,0.5])
+
+  def test_batch_errors(self):
+    for body in ('{"expressions":',
+                 '{"expressions":"3d6"}',
+                 '{"expressions":[3]}',
+                 '{}',
+                 '[]'):
+      self.assertEquals(self.post_batch(body).status_code,400)
+
+    too_many = ['d6']*(BATCH_MAX_EXPRESSIONS+1)
+    response = self.post_batch(json.dumps({'expressions':too_many}))
+    self.assertEquals(response.status_code,400)
+    response = self.client.get('/api/batch/',{'expression':too_many})
+    self.assertEquals(response.status_code,400)
+
+    response = self.client.get('/api/batch/',
+      {'expression':'d6','percentiles':'nan'})
+    self.assertEquals(response.status_code,400)
@@ -0,0 +1,152 @@
+"""
+Benchmarks of the die engine and the views, with fixed realistic inputs. Run
+them with ./manage.py benchmark, which prints the results as JSON so that
+they can be compared between releases.
+
+Every benchmark starts with empty caches, so the timings are for computing
+the results rather than looking them up. Plots are rendered in this process,
+so they use the same caches and do not include sending jobs to workers.
+"""
+from dice_probability import convolution
+from dice_probability import render
+from dice_probability.die import Die, LazyDie, fastsum
+from dice_probability.die import from_string, pool_from_string
+from dice_probability.die import collapse_cache, duplicate_cache, parse_cache
+from dice_probability.die import BOX_PERCENTILES
+
+import platform
+import timeit
+
+# Custom dice and pools used throughout, the kind of input the site gets.
+CUSTOM_DICE = ["10d30", "d4-d20", "3d6 2d8 d12", "d4 d30 d6 d30 d8"]
+DICE_POOLS = "1-30"
+PERCENTILES = BOX_PERCENTILES
+
+VIEW_MODES = ('target','vs','plot_target','plot_prob','plot_box')
+
+def clear_caches():
+  """Empty all process wide caches of the die engine."""
+  collapse_cache.clear()
+  duplicate_cache.clear()
+  parse_cache.clear()
+
+def bench_add():
+  a = Die(30).duplicate(5)
+  b = Die(20).duplicate(3)
+  return lambda: a + b
+
+def bench_duplicate():
+  die = Die(30)
+  return lambda: die.duplicate(10)
+
+def bench_fastsum():
+  dice = [ Die(n) for n in (4,6,8,10,12,20,30,30,30) ]
+  return lambda: fastsum(dice)
+
+def bench_collapse():
+  dice = [ from_string(LazyDie,raw)[0] for raw in CUSTOM_DICE ]
+  def run():
+    for d in dice:
+      d.collapse()
+  return run
+
+def bench_from_string():
+  def run():
+    for raw in CUSTOM_DICE:
+      parse_cache.clear()
+      from_string(Die,raw)
+  return run
+
+def bench_from_string_lazy():
+  def run():
+    for raw in CUSTOM_DICE:
+      parse_cache.clear()
+      from_string(LazyDie,raw)
+  return run
+
+def bench_pool_from_string():
+  return lambda: pool_from_string(Die,DICE_POOLS)
+
+def bench_percentile_reach():
+  dice = [ from_string(Die,raw)[0] for raw in CUSTOM_DICE ]
+  for d in dice:
+    d.percentile_reach(PERCENTILES)
+  return lambda: [ d.percentile_reach(PERCENTILES) for d in dice ]
+
+def view_benchmark(mode,format='png'):
+  """Benchmark the page, or the plot for plot modes, of a mode."""
+  def setup():
+    from django.test.client import RequestFactory
+    from dice_probability.views import _probability_reference
+
+    query = {'mode': mode, 'dice_pools': DICE_POOLS, 'format': format}
+    for (i,raw) in enumerate(CUSTOM_DICE):
+      query['%d-die'%i] = raw
+    request = RequestFactory().get('/',query)
+    stage = 'plot' if mode.startswith('plot') else 'html'
+    return lambda: _probability_reference(request, stage=stage)
+  return setup
+
+BENCHMARKS = [
+  ('die.add', bench_add),
+  ('die.duplicate', bench_duplicate),
+  ('die.fastsum', bench_fastsum),
+  ('lazydie.collapse', bench_collapse),
+  ('from_string', bench_from_string),
+  ('from_string.lazy', bench_from_string_lazy),
+  ('pool_from_string', bench_pool_from_string),
+  ('percentile_reach', bench_percentile_reach),
+]
+BENCHMARKS += [ ('view.%s'%mode, view_benchmark(mode)) for mode in VIEW_MODES ]
+BENCHMARKS += [
+  ('view.%s.svg'%mode, view_benchmark(mode,'svg'))
+  for mode in VIEW_MODES if mode.startswith('plot')
+]
+
+def measure(setup,repeat):
+  """
+  Time a benchmark. Each run gets empty caches and a fresh callable from
+  setup, and only calling it is timed.
+
+  Returns the timings in seconds.
+  """
+  times = []
+  for i in range(repeat):
+    clear_caches()
+    run = setup()
+    start = timeit.default_timer()
+    run()
+    times.append(timeit.default_timer() - start)
+  return times
+
+def run(repeat=10,names=None):
+  """
+  Run the benchmarks and get the results, ready to be encoded as JSON.
+
+  Arguments:
+    repeat:   Number of times to run each benchmark.
+    names:    Names of the benchmarks to run, all by default.
+  """
+  results = {}
+  pool = render._pool
+  render._pool = render.RenderPool(0,1,None)
+  try:
+    for (name,setup) in BENCHMARKS:
+      if names and name not in names:
+        continue
+      times = measure(setup,repeat)
+      results[name] = {
+        'runs': repeat,
+        'min': min(times),
+        'median': sorted(times)[len(times)//2],
+        'mean': sum(times)/len(times),
+        'max': max(times),
+      }
+  finally:
+    render._pool = pool
+
+  return {
+    'python': platform.python_version(),
+    'backend': convolution.backend().name,
+    'benchmarks': results,
+  }
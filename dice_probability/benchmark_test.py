@@ -0,0 +1,31 @@
+from dice_probability import benchmark
+from dice_probability import render
+from django.test import TestCase
+
+import json
+
+class TestBenchmark(TestCase):
+  def test_run(self):
+    names = ['die.add','from_string','view.vs']
+    results = benchmark.run(repeat=2,names=names)
+    self.assertEquals(sorted(results['benchmarks'].keys()),sorted(names))
+
+    for r in results['benchmarks'].values():
+      self.assertEquals(r['runs'],2)
+      self.assertTrue(0.0 <= r['min'] <= r['mean'] <= r['max'])
+    json.dumps(results)
+
+  def test_inline_plots(self):
+    # Plots are rendered in this process, and the pool is restored after.
+    pool = render.pool()
+    used = []
+    def setup():
+      used.append(render.pool())
+      return lambda: None
+    benchmark.BENCHMARKS.append(('test.pool',setup))
+    try:
+      benchmark.run(repeat=1,names=['test.pool'])
+    finally:
+      benchmark.BENCHMARKS.pop()
+    self.assertEquals(used[0].workers,0)
+    self.assertTrue(render.pool() is pool)
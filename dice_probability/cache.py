@@ -0,0 +1,106 @@
+"""A bounded, thread safe, least recently used cache with usage counters."""
+
+from collections import OrderedDict
+from threading import Lock
+
+class LRUCache(object):
+  """
+  Map keys to values, evicting the least recently used entries when either
+  the number of entries or their total size grows beyond the limits.
+  """
+
+  def __init__(self,max_entries=None,max_bytes=None,sizeof=None):
+    """
+    Arguments:
+      max_entries:  Maximum number of entries. None for infinite, the default.
+      max_bytes:    Maximum total size of the values in bytes.
+                    None for infinite, the default.
+      sizeof:       Function returning the size in bytes of a value.
+                    By default every value is considered to be 0 bytes.
+    """
+    self._lock = Lock()
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._sizeof = sizeof or (lambda value: 0)
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.configure(max_entries,max_bytes)
+
+  def configure(self,max_entries=None,max_bytes=None):
+    """Change the limits of the cache, evicting entries if needed."""
+    with self._lock:
+      self.max_entries = max_entries
+      self.max_bytes = max_bytes
+      self._evict()
+
+  def clear(self):
+    """Remove all entries and reset the counters."""
+    with self._lock:
+      self._entries.clear()
+      self._bytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def get(self,key,default=None):
+    """Get the value for key, or default if it is not cached."""
+    with self._lock:
+      try:
+        (value,size) = self._entries.pop(key)
+      except KeyError:
+        self.misses += 1
+        return default
+      self._entries[key] = (value,size)
+      self.hits += 1
+      return value
+
+  def put(self,key,value):
+    """Store value for key, replacing any previous value."""
+    size = self._sizeof(value)
+    with self._lock:
+      old = self._entries.pop(key,None)
+      if old is not None:
+        self._bytes -= old[1]
+      self._entries[key] = (value,size)
+      self._bytes += size
+      self._evict()
+
+  def lookup(self,key,compute):
+    """
+    Get the value for key. If it is not cached, it is computed by calling
+    compute without arguments and then stored.
+    """
+    value = self.get(key)
+    if value is None:
+      value = compute()
+      self.put(key,value)
+    return value
+
+  def stats(self):
+    """Get the usage counters, hit rate and current size of the cache."""
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': float(self.hits)/lookups if lookups else 0.0,
+        'evictions': self.evictions,
+        'entries': len(self._entries),
+        'bytes': self._bytes,
+      }
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self,key):
+    return key in self._entries
+
+  def _evict(self):
+    """Evict least recently used entries until the limits are met."""
+    while self._entries and (
+        (self.max_entries is not None and len(self._entries) > self.max_entries)
+        or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+      (key,(value,size)) = self._entries.popitem(last=False)
+      self._bytes -= size
+      self.evictions += 1
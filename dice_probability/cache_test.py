@@ -0,0 +1,67 @@
+from dice_probability.cache import LRUCache
+from django.test import TestCase
+
+class TestLRUCache(TestCase):
+  def test_get_put(self):
+    c = LRUCache()
+    self.assertEquals(c.get('a'),None)
+    self.assertEquals(c.get('a',0),0)
+    c.put('a',1)
+    self.assertEquals(c.get('a'),1)
+    c.put('a',2)
+    self.assertEquals(c.get('a'),2)
+    self.assertEquals(len(c),1)
+    self.assertTrue('a' in c)
+    self.assertFalse('b' in c)
+
+  def test_lookup(self):
+    c = LRUCache()
+    calls = []
+    def compute():
+      calls.append(1)
+      return 'value'
+
+    self.assertEquals(c.lookup('a',compute),'value')
+    self.assertEquals(c.lookup('a',compute),'value')
+    self.assertEquals(len(calls),1)
+
+  def test_max_entries(self):
+    c = LRUCache(max_entries=2)
+    c.put('a',1)
+    c.put('b',2)
+    c.get('a')
+    c.put('c',3)
+    self.assertTrue('a' in c)
+    self.assertFalse('b' in c)
+    self.assertTrue('c' in c)
+
+    c.configure(max_entries=1)
+    self.assertEquals(len(c),1)
+    self.assertTrue('c' in c)
+
+  def test_max_bytes(self):
+    c = LRUCache(max_bytes=10,sizeof=len)
+    c.put('a','x'*6)
+    c.put('b','x'*4)
+    self.assertEquals(len(c),2)
+    c.put('c','x'*1)
+    self.assertFalse('a' in c)
+    self.assertEquals(c.stats()['bytes'],5)
+
+    c.put('d','x'*20)
+    self.assertEquals(len(c),0)
+
+  def test_stats(self):
+    c = LRUCache(max_entries=1)
+    c.get('a')
+    c.put('a',1)
+    c.get('a')
+    c.put('b',2)
+    self.assertEquals(c.stats(),
+        {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'evictions': 1, 'entries': 1,
+         'bytes': 0})
+
+    c.clear()
+    self.assertEquals(c.stats(),
+        {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'evictions': 0, 'entries': 0,
+         'bytes': 0})
@@ -0,0 +1,391 @@
+"""
+Backends that combine probability distributions by discrete convolution.
+
+A backend decides how the sides of a die are stored and how two such
+distributions are convolved. The NumPy backend is used whenever NumPy is
+available, otherwise the pure Python backend is used.
+
+Sides are stored densely, but both backends skip sides with 0 probability
+when convolving, so dice with gaps between their outcomes, such as [1,0,0,1],
+only cost as much as their non-zero sides.
+"""
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+class PythonBackend(object):
+  """Store sides as lists of floats and convolve with plain Python loops."""
+
+  name = 'python'
+
+  def asarray(self,seq):
+    """Convert a sequence of probabilities to the storage type."""
+    return [ float(s) for s in seq ]
+
+  def tolist(self,sides):
+    """Convert stored sides to a list of floats."""
+    return [ float(s) for s in sides ]
+
+  def freeze(self,sides):
+    """Get an immutable version of the sides."""
+    return tuple(sides)
+
+  def negate(self,sides):
+    """Get the immutable negation of the sides."""
+    return tuple( -s for s in sides )
+
+  def trim(self,sides):
+    """Remove trailing sides with 0 probability."""
+    i = len(sides)
+    while i > 1 and sides[i-1] == 0.0:
+      i -= 1
+    return sides[:i]
+
+  def strip(self,sides):
+    """
+    Remove leading and trailing sides with 0 probability, keeping at least
+    one side. Returns the number of leading sides removed and the rest.
+    """
+    sides = self.trim(sides)
+    i = 0
+    while i < len(sides)-1 and sides[i] == 0.0:
+      i += 1
+    return (i, sides[i:])
+
+  def pad(self,sides,num,value):
+    """Get the immutable sides preceded by num copies of value."""
+    return tuple([value]*num) + tuple(sides)
+
+  def convolve(self,a,b):
+    """Compute the distribution of the sum of two distributions."""
+    result = [0.0]*( len(a) + len(b) - 1 )
+    nonzero = [ (j,bp) for (j,bp) in enumerate(b) if bp != 0.0 ]
+    for (i,ap) in enumerate(a):
+      if ap == 0.0:
+        continue
+      for (j,bp) in nonzero:
+        result[i+j] += ap*bp
+    return result
+
+  def kernel(self,a,b):
+    """Get the name of the method convolve() uses for a and b."""
+    return 'sparse'
+
+  def uses_fft(self,a,b):
+    """Check if convolve() computes the convolution in frequency space."""
+    return False
+
+  def convolve_counts(self,a,b):
+    """Convolve two sequences of integer outcome counts exactly."""
+    result = [0]*( len(a) + len(b) - 1 )
+    nonzero = [ (j,bc) for (j,bc) in enumerate(b) if bc != 0 ]
+    for (i,ac) in enumerate(a):
+      if ac == 0:
+        continue
+      for (j,bc) in nonzero:
+        result[i+j] += ac*bc
+    return result
+
+  def normalize(self,counts,denom):
+    """Convert outcome counts with a common denominator to sides."""
+    return [ float(c)/denom for c in counts ]
+
+  def reach(self,sides):
+    """
+    Compute the immutable probabilities to roll at least each outcome,
+    followed by 0.0.
+    """
+    reach = []
+    s = 1.0
+    for w in sides:
+      reach.append(max(s,0.0))
+      s -= w
+    reach.append(0.0)
+    return tuple(reach)
+
+  def reach_counts(self,counts,denom):
+    """
+    Compute the immutable probabilities to roll at least each outcome,
+    followed by 0.0, exactly from outcome counts with a common denominator.
+    """
+    reach = []
+    s = denom
+    for c in counts:
+      reach.append(float(s)/denom)
+      s -= c
+    reach.append(0.0)
+    return tuple(reach)
+
+  def prune(self,sides,budget):
+    """
+    Drop the first and last sides with a total probability of at most budget
+    at each end, keeping at least one side. Returns the number of sides
+    dropped at the start, the remaining sides and the dropped probability.
+    """
+    lo = 0
+    low = 0.0
+    while lo < len(sides)-1 and low + sides[lo] <= budget:
+      low += sides[lo]
+      lo += 1
+
+    hi = len(sides)
+    high = 0.0
+    while hi-1 > lo and high + sides[hi-1] <= budget:
+      high += sides[hi-1]
+      hi -= 1
+
+    return (lo, list(sides[lo:hi]), low+high)
+
+  def use_power(self,size):
+    """Check if power() should be used to get a result with size sides."""
+    return False
+
+  def power(self,sides,num):
+    """
+    Compute the distribution of the sum of num copies of a distribution, at
+    least one, by repeated squaring.
+    """
+    result = None
+    while True:
+      if num & 1:
+        result = sides if result is None else self.convolve(result,sides)
+      num >>= 1
+      if num == 0:
+        return list(result)
+      sides = self.convolve(sides,sides)
+
+class NumpyBackend(object):
+  """
+  Store sides as contiguous float64 arrays. Small distributions are convolved
+  directly, big ones by multiplication in frequency space and those with
+  few non-zero sides by multiplying only those.
+  """
+
+  name = 'numpy'
+
+  # Use FFT when both operands have at least this many sides.
+  fft_threshold = 64
+
+  # Multiply only the non-zero sides when that is at least sparse_factor
+  # times fewer multiplications than direct convolution, which in turn is at
+  # least sparse_threshold multiplications.
+  sparse_factor = 8
+  sparse_threshold = 1024
+
+  # Use power() to duplicate dice when the result has at least this many sides.
+  power_threshold = 256
+
+  def asarray(self,seq):
+    """Convert a sequence of probabilities to the storage type."""
+    return numpy.ascontiguousarray(seq,dtype=numpy.float64)
+
+  def tolist(self,sides):
+    """Convert stored sides to a list of floats."""
+    return numpy.asarray(sides,dtype=numpy.float64).tolist()
+
+  def freeze(self,sides):
+    """Get an immutable version of the sides."""
+    sides = self.asarray(sides)
+    sides.flags.writeable = False
+    return sides
+
+  def negate(self,sides):
+    """Get the immutable negation of the sides."""
+    return self.freeze(numpy.negative(sides))
+
+  def trim(self,sides):
+    """Remove trailing sides with 0 probability."""
+    sides = self.asarray(sides)
+    nonzero = numpy.flatnonzero(sides)
+    if len(nonzero) == 0:
+      return sides[:1]
+    return sides[:nonzero[-1]+1]
+
+  def strip(self,sides):
+    """
+    Remove leading and trailing sides with 0 probability, keeping at least
+    one side. Returns the number of leading sides removed and the rest.
+    """
+    sides = self.asarray(sides)
+    nonzero = numpy.flatnonzero(sides)
+    if len(nonzero) == 0:
+      return (0, sides[:1])
+    return (int(nonzero[0]), sides[nonzero[0]:nonzero[-1]+1])
+
+  def pad(self,sides,num,value):
+    """Get the immutable sides preceded by num copies of value."""
+    result = numpy.empty(num+len(sides))
+    result[:num] = value
+    result[num:] = sides
+    return self.freeze(result)
+
+  def convolve(self,a,b):
+    """Compute the distribution of the sum of two distributions."""
+    kernel = self.kernel(a,b)
+    if kernel == 'sparse':
+      a = numpy.asarray(a,dtype=numpy.float64)
+      b = numpy.asarray(b,dtype=numpy.float64)
+      (index,values) = self._sparse_products(a,b)
+      return numpy.bincount(index,values,len(a)+len(b)-1)
+    elif kernel == 'fft':
+      return self._fft_convolve(a,b)
+    return numpy.convolve(a,b)
+
+  def kernel(self,a,b):
+    """
+    Get the name of the method convolve() uses for a and b: 'sparse' to
+    multiply only the non-zero sides, 'fft' to multiply in frequency space or
+    'direct' to convolve directly.
+    """
+    work = len(a)*len(b)
+    if work >= self.sparse_threshold:
+      nonzero = numpy.count_nonzero(a)*numpy.count_nonzero(b)
+      if self.sparse_factor*nonzero <= work:
+        return 'sparse'
+    if min(len(a),len(b)) >= self.fft_threshold:
+      return 'fft'
+    return 'direct'
+
+  def uses_fft(self,a,b):
+    """Check if convolve() computes the convolution in frequency space."""
+    return self.kernel(a,b) == 'fft'
+
+  def _sparse_products(self,a,b):
+    """
+    Multiply each non-zero side of a with each non-zero side of b. Returns
+    the outcome and the product of each pair.
+    """
+    ia = numpy.flatnonzero(a)
+    ib = numpy.flatnonzero(b)
+    index = numpy.add.outer(ia,ib).ravel()
+    values = numpy.multiply.outer(a[ia],b[ib]).ravel()
+    return (index,values)
+
+  def convolve_counts(self,a,b):
+    """
+    Convolve two sequences of integer outcome counts exactly. The sum of the
+    result must fit in an int64.
+    """
+    a = numpy.asarray(a,dtype=numpy.int64)
+    b = numpy.asarray(b,dtype=numpy.int64)
+    if self.kernel(a,b) != 'sparse':
+      return numpy.convolve(a,b).tolist()
+
+    (index,values) = self._sparse_products(a,b)
+    result = numpy.zeros(len(a)+len(b)-1,dtype=numpy.int64)
+    numpy.add.at(result,index,values)
+    return result.tolist()
+
+  def normalize(self,counts,denom):
+    """Convert outcome counts with a common denominator to sides."""
+    return numpy.asarray(counts,dtype=numpy.float64) / denom
+
+  def reach(self,sides):
+    """
+    Compute the immutable probabilities to roll at least each outcome,
+    followed by 0.0.
+    """
+    reach = numpy.empty(len(sides)+1)
+    reach[0] = 1.0
+    numpy.subtract(1.0, numpy.cumsum(sides), out=reach[1:])
+    numpy.maximum(reach, 0.0, out=reach)
+    reach[-1] = 0.0
+    return self.freeze(reach)
+
+  def reach_counts(self,counts,denom):
+    """
+    Compute the immutable probabilities to roll at least each outcome,
+    followed by 0.0, exactly from outcome counts with a common denominator.
+    """
+    reach = numpy.empty(len(counts)+1)
+    reach[0] = 1.0
+    remaining = denom - numpy.cumsum(numpy.asarray(counts,dtype=numpy.int64))
+    numpy.divide(remaining, float(denom), out=reach[1:])
+    return self.freeze(reach)
+
+  def _fft_convolve(self,a,b):
+    """Convolve two distributions using real valued FFT."""
+    size = len(a) + len(b) - 1
+    n = _fft_size(size)
+    result = numpy.fft.irfft(numpy.fft.rfft(a,n) * numpy.fft.rfft(b,n), n)
+    return self._denoise(result[:size], _lowest(a) + _lowest(b))
+
+  def prune(self,sides,budget):
+    """
+    Drop the first and last sides with a total probability of at most budget
+    at each end, keeping at least one side. Returns the number of sides
+    dropped at the start, the remaining sides and the dropped probability.
+    """
+    sides = numpy.asarray(sides,dtype=numpy.float64)
+    low = numpy.cumsum(sides)
+    lo = min(int(numpy.searchsorted(low,budget,'right')), len(sides)-1)
+    high = numpy.cumsum(sides[:lo:-1])
+    hi = len(sides) - int(numpy.searchsorted(high,budget,'right'))
+
+    dropped = 0.0
+    if lo > 0:
+      dropped += low[lo-1]
+    if hi < len(sides):
+      dropped += high[len(sides)-hi-1]
+    return (lo, sides[lo:hi].copy(), float(dropped))
+
+  def use_power(self,size):
+    """Check if power() should be used to get a result with size sides."""
+    return size >= self.power_threshold
+
+  def power(self,sides,num):
+    """
+    Compute the distribution of the sum of num copies of a distribution by
+    transforming it once, raising it to the power of num in frequency space
+    and transforming it back.
+    """
+    size = num*(len(sides) - 1) + 1
+    n = _fft_size(size)
+    result = numpy.fft.irfft(numpy.fft.rfft(sides,n)**num, n)
+    return self._denoise(result[:size], num*_lowest(sides))
+
+  def _denoise(self,sides,lowest):
+    """
+    Remove rounding noise from an FFT result. Outcomes below the lowest
+    possible one are exactly 0 and no probability can be negative.
+    """
+    sides = numpy.ascontiguousarray(sides)
+    sides[:lowest] = 0.0
+    numpy.maximum(sides, 0.0, out=sides)
+    return sides
+
+def _lowest(sides):
+  """Index of the first side with non-zero probability."""
+  return int(numpy.flatnonzero(sides)[0])
+
+def _fft_size(size):
+  """Smallest power of 2 that is at least size."""
+  n = 1
+  while n < size:
+    n *= 2
+  return n
+
+_BACKENDS = { 'python': PythonBackend }
+if numpy is not None:
+  _BACKENDS['numpy'] = NumpyBackend
+
+_backend = None
+
+def set_backend(name):
+  """
+  Select the convolution backend by name, 'numpy' or 'python'. Backends
+  accept the sides stored by each other, so existing dice remain usable.
+  """
+  global _backend
+  try:
+    _backend = _BACKENDS[name]()
+  except KeyError:
+    raise ValueError('Unknown convolution backend: %s'%name)
+
+def backend():
+  """Get the active convolution backend."""
+  return _backend
+
+set_backend('numpy' if numpy is not None else 'python')
@@ -0,0 +1,88 @@
+from dice_probability import convolution
+from dice_probability.die import Die, fastsum
+from django.test import TestCase
+
+class TestConvolution(TestCase):
+  def setUp(self):
+    self._backend_name = convolution.backend().name
+
+  def tearDown(self):
+    convolution.set_backend(self._backend_name)
+
+  def test_set_backend(self):
+    convolution.set_backend('python')
+    self.assertEquals(convolution.backend().name,'python')
+    self.assertRaises(ValueError,convolution.set_backend,'nonexistent')
+
+  def test_python(self):
+    b = convolution.PythonBackend()
+    self.assertEquals(b.convolve([0.0,0.5,0.5],[0.0,0.5,0.5]),
+        [0.0,0.0,0.25,0.5,0.25])
+    self.assertEquals(b.trim([0.0,1.0,0.0,0.0]),[0.0,1.0])
+    self.assertEquals(b.trim([1.0]),[1.0])
+
+  def test_backends_agree(self):
+    convolution.set_backend('python')
+    python = Die(6) + Die(8) + Die([1,2,3])
+    convolution.set_backend('numpy')
+    numpy = Die(6) + Die(8) + Die([1,2,3])
+    self.assertEquals(python,numpy)
+
+  def test_fft(self):
+    b = convolution.NumpyBackend()
+    a = Die(10).duplicate(10)
+    c = Die(8).duplicate(12)
+    self.assertTrue(a.max_side()+1 >= b.fft_threshold)
+    self.assertTrue(c.max_side()+1 >= b.fft_threshold)
+
+    fft = Die._from_sides(b.convolve(a._sides,c._sides),
+      a.min_side()+c.min_side())
+    direct = Die._from_sides(convolution.PythonBackend().convolve(
+      a.probability(),c.probability()))
+    self.assertEquals(fft,direct)
+    self.assertEquals(fft.probability()[:22],[0.0]*22)
+
+  def test_power(self):
+    b = convolution.NumpyBackend()
+    die = Die(100)
+    self.assertTrue(b.use_power(10*die.max_side()+1))
+
+    power = Die._from_sides(b.power(die._sides,10),10*die.min_side())
+    summed = fastsum([die]*10)
+    self.assertEquals(power,summed)
+    self.assertEquals(power.max_side(),1000)
+    self.assertEquals(power.probability()[:10],[0.0]*10)
+
+    python = convolution.PythonBackend()
+    self.assertFalse(python.use_power(10**6))
+    for num in (1,2,5,8):
+      self.assertTrue(Die._from_sides(python.power(Die(6)._sides,num),num)
+        .similar_to(Die(6).duplicate(num)))
+
+  def test_prune(self):
+    sides = [0.0,0.01,0.02,0.9,0.04,0.03]
+    for b in (convolution.PythonBackend(),convolution.NumpyBackend()):
+      (first,pruned,dropped) = b.prune(sides,0.035)
+      self.assertEquals((first,list(pruned)),(3,[0.9,0.04]))
+      self.assertAlmostEqual(dropped,0.06)
+
+      (first,pruned,dropped) = b.prune([1.0],0.5)
+      self.assertEquals((first,list(pruned),dropped),(0,[1.0],0.0))
+
+  def test_sparse(self):
+    b = convolution.NumpyBackend()
+    gapped = [1]+[0]*98+[1]
+    self.assertEquals(b.kernel(gapped,gapped),'sparse')
+    self.assertEquals(b.kernel(gapped,[1]*100),'sparse')
+    self.assertEquals(b.kernel([1]*100,[1]*100),'fft')
+    self.assertEquals(b.kernel([1]*6,[1]*6),'direct')
+
+    expected = convolution.PythonBackend().convolve_counts(gapped,gapped)
+    self.assertEquals(b.convolve_counts(gapped,gapped),expected)
+    self.assertEquals(list(b.convolve(gapped,gapped)),
+      [ float(c) for c in expected ])
+
+    # Gapped dice are summed exactly instead of in frequency space.
+    die = Die(gapped)
+    self.assertFalse(b.uses_fft(die._counts,die._counts))
+    self.assertEquals((die+die)._counts,(1,)+(0,)*98+(2,)+(0,)*98+(1,))
@@ -1,10 +1,21 @@
 """
 Combine dice and compute probabilities for the composite die, also allow rolling of such dice.
 """
-import random
 import re
-
+import string
+from bisect import bisect_left, bisect_right
+from fractions import gcd
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from dice_probability import convolution
+from dice_probability import timing
+from dice_probability.cache import LRUCache
 from dice_probability.queue import AbstractQueue
+from dice_probability.sampler import AliasSampler
 from dice_probability.doc import docfrom, inheritdoc
 
 class DieParseException(Exception):
@@ -14,8 +25,20 @@ class DieParseException(Exception):
   """
   pass
 
+# Dice are kept as exact integer outcome counts as long as the common
+# denominator of the counts is at most this big, so that the counts always
+# fit in an int64.
+_MAX_EXACT_DENOM = 2**62
+
+# Percentiles of the whiskers, quartiles and median of box plots, highest
+# first.
+BOX_PERCENTILES = (0.95, 0.75, 0.5, 0.25, 0.05)
+
 class Die(object):
-  """A generalized die."""
+  """
+  A generalized die. Only the span of outcomes from the smallest to the
+  biggest possible one is stored, together with the smallest outcome.
+  """
 
   def __init__(self,arg):
     """
@@ -25,42 +48,94 @@ class Die(object):
     """
 
     self._reach = None
+    self._reach_keys = None
     self._cmp = None
+    self._hashkey = None
+    self._sampler = None
+    self._counts = None
+    self._denom = None
+    self._offset = 0
+    self._dense = None
+    self._epsilon = 0.0
+    self._error = 0.0
+
+    backend = convolution.backend()
 
     if isinstance(arg,Die):
       self._sides = arg._sides
+      self._offset = arg._offset
+      self._dense = arg._dense
       self._reach = arg._reach
+      self._reach_keys = arg._reach_keys
+      self._hashkey = arg._hashkey
+      self._sampler = arg._sampler
+      self._counts = arg._counts
+      self._denom = arg._denom
+      self._epsilon = arg._epsilon
+      self._error = arg._error
     elif type(arg) is list:
       if len(arg)==0:
-        self._sides = [1.0]
+        self._set_counts([1])
       elif isinstance(arg[0],Die):
         die = sum(arg[1:], arg[0])
         self._sides = die._sides
+        self._offset = die._offset
         self._reach = die._reach
+        self._reach_keys = die._reach_keys
+        self._counts = die._counts
+        self._denom = die._denom
+        self._epsilon = die._epsilon
+        self._error = die._error
       else:
         total_probability = float(sum(arg))
 
         if total_probability == 0.0 or any(float(s)<0.0 for s in arg):
           raise ValueError('Invalid probabilities.')
 
-        self._sides = [ float(s)/total_probability for s in arg ]
-
-        # Remove trailing sides with 0 probability.
-        i = len(self._sides)
-        while self._sides[i-1] == 0.0:
-          i -= 1
-        self._sides[i:] = []
+        if (all(float(s).is_integer() for s in arg)
+            and sum(arg) <= _MAX_EXACT_DENOM):
+          self._set_counts([ int(s) for s in arg ])
+        else:
+          (self._offset,self._sides) = backend.strip(backend.asarray(
+            [ float(s)/total_probability for s in arg ]))
 
     elif type(arg) is int:
       if arg>0:
-        self._sides = [0.0] + [1.0/arg]*arg
+        self._set_counts([0] + [1]*arg)
       elif arg==0:
-        self._sides = [1.0]
+        self._set_counts([1])
       else:
         raise ValueError('A die cannot have negative number of sides.')
     else:
       raise TypeError('Die.__init__() either takes a die, a list or an integer.')
 
+  def _set_counts(self,counts,denom=None,offset=0):
+    """
+    Set the sides from integer outcome counts, starting at outcome offset,
+    and their common denominator, by default the sum of the counts. The
+    counts are reduced and stripped of leading and trailing zeros so that
+    each distribution has a single exact representation.
+    """
+    if denom is None:
+      denom = sum(counts)
+
+    i = len(counts)
+    while i > 1 and counts[i-1] == 0:
+      i -= 1
+    j = 0
+    while j < i-1 and counts[j] == 0:
+      j += 1
+
+    divisor = reduce(gcd, counts[j:i], denom)
+    self._counts = tuple( c//divisor for c in counts[j:i] )
+    self._denom = denom//divisor
+    self._offset = offset + j
+    self._sides = convolution.backend().normalize(self._counts,self._denom)
+
+  def is_exact(self):
+    """Check if the die is represented by exact integer outcome counts."""
+    return self._counts is not None
+
   @classmethod
   def const(self,value):
     """
@@ -68,8 +143,116 @@ class Die(object):
     """
     if type(value) is not int:
       raise TypeError('Die.const() only takes an integer.')
+    if value < 0:
+      raise ValueError('A die cannot have negative outcomes.')
+
+    return Die._from_counts([1],1,value)
+
+  @classmethod
+  def _from_sides(self,sides,offset=0):
+    """
+    Create a die from normalized sides, starting at outcome offset, as
+    produced by the convolution backend. The sides are kept as they are, as
+    rounding may give 0 probability to outcomes that are possible.
+    """
+    die = Die.__new__(Die)
+    die._reach = None
+    die._reach_keys = None
+    die._cmp = None
+    die._hashkey = None
+    die._sampler = None
+    die._counts = None
+    die._denom = None
+    die._epsilon = 0.0
+    die._error = 0.0
+    die._offset = offset
+    die._dense = None
+    die._sides = sides
+    return die
+
+  @classmethod
+  def _from_counts(self,counts,denom,offset=0):
+    """
+    Create a die from integer outcome counts, starting at outcome offset, and
+    their common denominator.
+    """
+    die = Die._from_sides([1.0])
+    die._set_counts(counts,denom,offset)
+    return die
 
-    return self([0.0]*value + [1.0])
+  def _key(self):
+    """
+    Get a hashable key identifying the distribution of the die. Exact dice
+    are identified by their counts, denominator and smallest outcome, others
+    by their probabilities and the epsilon they are pruned with. The keys
+    are tagged with the kind of die, so the two never compare equal.
+    """
+    if self._hashkey is None:
+      if self.is_exact():
+        self._hashkey = ('exact',self._counts,self._denom,self._offset)
+      else:
+        self._hashkey = ('float',
+          tuple(convolution.backend().tolist(self._sides)),
+          self._offset,self._epsilon)
+    return self._hashkey
+
+  def _nbytes(self):
+    """
+    Approximate memory used by the die, including the reach, padded
+    probabilities and sampler built on first use, so that caches of shared
+    dice bound the memory they end up holding.
+    """
+    span = len(self._sides)
+    full = self._offset + span
+    # The objects themselves, sides, reach, reach keys and padded
+    # probabilities.
+    size = 512 + 8*span + 8*(full+1) + 8*(span+1) + 8*full
+    # The sampler holds three lists of Python numbers and arrays of them.
+    size += 104*span
+    if self.is_exact():
+      # The counts are a tuple of Python ints.
+      size += 40*span
+    return size
+
+  def _freeze(self):
+    """Make the sides immutable so the die can be shared. Returns the die."""
+    self._sides = convolution.backend().freeze(self._sides)
+    return self
+
+  def prune(self,epsilon):
+    """
+    Get a die where the least likely outcomes at either end, with a total
+    probability of at most epsilon, are dropped. Dice summed with the pruned
+    die are pruned in the same way, so that the number of outcomes only grows
+    with the outcomes that matter. The dropped probability is reported by
+    error().
+
+    Arguments:
+      epsilon:  The probability that may be dropped each time a die is
+                pruned. 0.0 to get the die as is.
+    """
+    if epsilon <= 0.0:
+      return self
+    return self._prune(epsilon,self._error)
+
+  def _prune(self,epsilon,error):
+    """
+    Prune the die with epsilon, see prune(), given that error probability
+    was already dropped from it.
+    """
+    (first,sides,dropped) = convolution.backend().prune(self._sides,epsilon/2)
+    die = Die._from_sides(sides,self._offset+first)._freeze()
+    die._epsilon = epsilon
+    die._error = error + dropped
+    return die
+
+  def error(self):
+    """
+    Get the total probability dropped by pruning the die and the dice it is
+    made from. The probability of each outcome, and to reach it, is off by at
+    most this much.
+    """
+    return self._error
 
   def __add__(self,other):
     """
@@ -79,15 +262,29 @@ class Die(object):
     if not isinstance(other,Die):
       raise TypeError('Only a die can be added to another die.')
 
-    sides = [0.0]*( self.max_side() + other.max_side() + 1 )
-
-    outcomes = ( (sv+ov,sp*op) for (sv,sp) in enumerate(self._sides)
-                               for (ov,op) in enumerate(other._sides) )
-
-    for (v,p) in outcomes:
-      sides[v] += p
+    die = self._sum(other)
+    epsilon = max(self._epsilon,other._epsilon)
+    if epsilon > 0.0:
+      die = die._prune(epsilon,self._error+other._error)
+    return die
 
-    return Die(sides)
+  def _sum(self,other):
+    """
+    Add two dice together without pruning. The spans of the dice are
+    convolved and their smallest outcomes added.
+    """
+    backend = convolution.backend()
+    offset = self._offset + other._offset
+    if (self.is_exact() and other.is_exact()
+        and self._denom*other._denom <= _MAX_EXACT_DENOM
+        and not backend.uses_fft(self._counts, other._counts)):
+      counts = backend.convolve_counts(self._counts, other._counts)
+      timing.count('convolve',len(counts))
+      return Die._from_counts(counts, self._denom*other._denom, offset)
+
+    sides = backend.convolve(self._sides, other._sides)
+    timing.count('convolve',len(sides))
+    return Die._from_sides(sides,offset)
 
   def duplicate(self,num):
     """Duplicate the die the given number of times."""
@@ -97,51 +294,54 @@ class Die(object):
 
     if num == 0:
       return Die.const(0)
+    if num == 1:
+      return self
 
-    # Find all powers of 2 less than or equal to num
-    pow2 = [1]
-    while pow2[-1] <= num:
-      pow2.append(pow2[-1]*2)
-    pow2.pop()
-
-    # Cache has space for all such powers of 2
-    cache = [None]*len(pow2)
-
-    # Populate cache
-    cache[0] = self
-    die = self
-    for i in xrange(1,len(pow2)):
-      die += die
-      cache[i] = die
-    # Cache now contains: cache[i] = self.duplicate(2**i)
-
-    req = [None]*len(pow2)
-    rest = num
-    for i, p in enumerate(reversed(pow2),1):
-      if p <= rest:
-        req[-i] = cache[-i]
-        rest -= p
-
-    return fastsum(d for d in req if d is not None)
-
-  def _duplicate(self,num,cache):
-    """Duplicate the die the given number of times."""
-    try:
-      return cache[num]
-    except KeyError:
-      die = cache[num/2]
-      die += die
-      if num%2 != 0:
-        die += cache[num%2]
+    return duplicate_cache.lookup(
+      (self._key(),num), lambda: self._duplicate(num))
+
+  def _duplicate(self,num):
+    """
+    Duplicate the die the given number of times, at least twice. Builds on
+    powers of 2 that are shared with other duplications of the same die
+    through duplicate_cache.
+    """
+    backend = convolution.backend()
+    if backend.use_power(num*(len(self._sides)-1) + 1):
+      die = Die._from_sides(backend.power(self._sides,num),num*self._offset)
+      timing.count('power',len(die._sides))
+      if self._epsilon > 0.0:
+        die = die._prune(self._epsilon,num*self._error)
+    elif num & (num-1) == 0:
+      half = self.duplicate(num/2)
+      die = half + half
+    else:
+      # Sum up the powers of 2 that num consists of.
+      pow2 = []
+      p = 1
+      while p <= num:
+        if num & p:
+          pow2.append(p)
+        p *= 2
+      die = fastsum(self.duplicate(p) for p in pow2)
+
+    return die._freeze()
 
   def max_side(self):
     """Get the biggest possible outcome."""
-    return len(self._sides) - 1
+    return self._offset + len(self._sides) - 1
+
+  def min_side(self):
+    """Get the smallest possible outcome."""
+    return self._offset
 
   def __eq__(self,other):
     """
-    Check if two dice are similar enough. Workaround for inexact float results.
+    Check if two dice are equal. Exact dice are compared exactly, others are
+    compared with similar_to() as a workaround for inexact float results.
     """
+    if self.is_exact() and other.is_exact():
+      return self._key() == other._key()
     return self.similar_to(other)
 
   def __cmp__(self,other):
@@ -154,13 +354,13 @@ class Die(object):
     elif self.similar_to(other):
       return 0
     else:
-      return cmp(self._sides,other._sides)
+      return cmp(self.probability(),other.probability())
 
   def similar_to(self,other,ndigits=12):
     """
     Check if two dice are similar enough Workaround for inexact float results.
     """
-    for (x,y) in map(None,self._sides, other._sides):
+    for (x,y) in map(None,self.probability(), other.probability()):
       if x!=y:
         if x is None or y is None:
           return False
@@ -170,23 +370,53 @@ class Die(object):
 
   def probability(self):
     """Get the probabilities for rolling the positional number."""
-    return self._sides
+    return [0.0]*self._offset + convolution.backend().tolist(self._sides)
+
+  def probability_array(self):
+    """
+    Get the probabilities for rolling the positional number as a read-only
+    array. The array is built on first use for dice that can not roll 0.
+    """
+    if self._offset == 0:
+      return self._freeze()._sides
+    if self._dense is None:
+      self._dense = convolution.backend().pad(self._sides,self._offset,0.0)
+    return self._dense
 
   def _compute_reach(self):
-    """Compute the probabilities to roll at least the positional number."""
+    """
+    Compute the probabilities to roll at least the positional number,
+    followed by 0.0, as a read-only array.
+    """
 
     if self._reach is None:
-      self._reach = []
+      backend = convolution.backend()
+      if self.is_exact():
+        reach = backend.reach_counts(self._counts,self._denom)
+      else:
+        reach = backend.reach(self._sides)
 
-      s = 1.0
-      for w in self._sides:
-        self._reach.append(max(s,0))
-        s -= w
+      # Ascending keys for bisection in percentiles_from_reach(), for the
+      # outcomes from the smallest one.
+      self._reach_keys = backend.negate(reach)
+      if self._offset > 0:
+        reach = backend.pad(reach,self._offset,1.0)
+      self._reach = reach
 
   def probability_reach(self):
     """Get the probabilities to roll at least the positional number."""
+    return convolution.backend().tolist(self.probability_reach_array())
+
+  def probability_reach_array(self,padded=False):
+    """
+    Get the probabilities to roll at least the positional number as a
+    read-only array, without copying. If padded, the array ends with an extra
+    0.0 for the outcome after the biggest one.
+    """
     self._compute_reach()
-    return self._reach
+    if padded:
+      return self._reach
+    return self._reach[:-1]
 
   def probability_vs(self,opponent):
     """Compute probability to roll higher than opponent die."""
@@ -194,60 +424,86 @@ class Die(object):
     # least 1 more than that. Sum that up and we have the probability to beat
     # the opponent.
     return sum([ p*pr for (p,pr) in 
-      zip(opponent.probability(), self.probability_reach()[1:]) ])
+      zip(opponent.probability_array(), self.probability_reach_array()[1:]) ])
 
   def probability_eq(self,other):
     """Compute probability that two different die roll the same result."""
     return sum([ sp*op for (sp,op) in 
-      zip(self.probability(),other.probability()) ])
+      zip(self.probability_array(),other.probability_array()) ])
 
   def roll(self,rnd=None):
-    """Roll the die."""
-    if rnd is None: 
-      rnd = random.random()
+    """
+    Roll the die. A random number in [0.0, 1.0) can be supplied, in which
+    case the outcome is the smallest one where the cumulative probability
+    exceeds it.
+    """
+    if rnd is None:
+      return self.sampler().sample()
     elif not (0.0 <= rnd < 1.0):
       raise ValueError("rnd must be in [0.0, 1.0)")
+    if self._epsilon > 0.0:
+      # Pruned dice only hold the probability that remains.
+      rnd *= float(sum(self._sides))
     for i, w in enumerate(self._sides):
       rnd -= w
       if rnd < 0.0:
-        return i
+        return self._offset + i
+    # Only reached through rounding errors.
+    return self.max_side()
 
-  def percentile_reach(self,percentiles):
+  def sampler(self):
+    """Get the alias method sampler for the die, built on first use."""
+    if self._sampler is None:
+      self._sampler = AliasSampler(self.probability())
+    return self._sampler
+
+  def roll_many(self,num,rng=None):
     """
-    Get the target values corresponding to the percentiles. A target value can be a rational number between the two closest integers.
+    Roll the die num times. Returns a NumPy array of outcomes.
+
+    Arguments:
+      num:    Number of times to roll the die.
+      rng:    Random number generator with a random_sample() method, such as
+              numpy.random.RandomState. numpy.random by default.
     """
-    return [ self._percentile_reach(p) for p in percentiles ]
+    return self.sampler().sample_many(num,rng)
 
-  def _percentile_reach(self,p):
+  def percentile_reach(self,percentiles):
     """
-    Get the target value corresponding to the percentile. The target value can be a rational number.
+    Get the target values corresponding to the percentiles. A target value can be a rational number between the two closest integers.
     """
-    p = float(p)
-    result = self.probability_reach() + [0.0]
-    if p<0.0 or p>1.0:
-      raise ValueError("Percentile must in [0.0, 1.0]")
-
-    i = 0
-    while result[i]==1.0:
-      i += 1
-    if p>result[i]:
-      return i-1
-
-    i = len(result)-1
-    while result[i]==0.0:
-      i -= 1
-    if p<result[i]:
-      return i
-
-    right = 1
-    while result[right]>p:
-      right += 1
-
-    left = right-1
-    while result[left]==result[right]:
-      left -= 1
+    self._compute_reach()
+    return [ self._offset + p
+             for p in percentiles_from_reach(self._reach_keys,percentiles) ]
 
-    return left + (right-left)*(result[left]-p)/(result[left]-result[right])
+def percentiles_from_reach(keys,percentiles):
+  """
+  Get the target values corresponding to the percentiles, by bisection of the
+  negated probabilities to reach each outcome followed by 0.0. A target value
+  can be a rational number between the two closest integers.
+  """
+  percentiles = [ float(p) for p in percentiles ]
+  if any(p<0.0 or p>1.0 for p in percentiles):
+    raise ValueError("Percentile must in [0.0, 1.0]")
+
+  # First outcome that is not always reached, last one that can be reached.
+  first = bisect_right(keys,-1.0)
+  last = bisect_left(keys,0.0) - 1
+
+  result = []
+  for p in percentiles:
+    if p > -keys[first]:
+      result.append(first-1)
+    elif p < -keys[last]:
+      result.append(last)
+    else:
+      # First outcome reached with probability at most p, and the outcome
+      # before the plateau it is on.
+      right = bisect_left(keys,-p)
+      left = bisect_left(keys,keys[right]) - 1
+      result.append(
+        left + (right-left)*(-keys[left]-p)/(-keys[left]+keys[right]))
+  return result
 
 class DiceCounter(object):
   """
@@ -291,138 +547,261 @@ class SideReader(object):
 
 _POOL_DIE = Die([7,4,1])
 
-_RE_CONST = re.compile('^(\d+)$')
-_RE_SINGLE = re.compile('^[dD](\d+)$')
-_RE_MULTI = re.compile('^(\d+)[dD](\d+)$')
-_RE_SEQ = re.compile('^[dD](\d+)-[dD](\d+)$')
-_RE_POOL = re.compile('^(\d*)[pP]$')
-_RE_LIST = re.compile('^(\d*)\[(\d+(?:,\d+)*)\]$')
+# A single term of a die description. Exactly one of the named groups of the
+# alternatives is set for a matching term.
+_RE_TERM = re.compile(r"""
+  (?:
+    (?P<const>\d+)
+  | (?P<copies>\d*)[dD](?P<sides>\d+)
+  | [dD](?P<seq_start>\d+)-[dD](?P<seq_stop>\d+)
+  | (?P<pool>\d*)[pP]
+  | (?P<list_copies>\d*)\[(?P<list>\d+(?:,\d+)*)\]
+  )$""", re.VERBOSE)
 
 _DIE_SEQ = [4,6,8,10,12,20]
 
-def from_string(makedie,raw,max_sides=None,max_dice=None):
+def _copies(raw):
+  """Read an optional number of copies, None if not given."""
+  if raw:
+    return int(raw)
+  return None
+
+def parse_terms(raw,max_sides=None,max_dice=None):
   """
-  Create the composite die described in the string.
+  Parse a die description into its terms, without creating any dice. The
+  limits on the number of sides and dice are checked on the terms, so
+  invalid input is rejected before any probabilities are computed.
+
+  Each term is a tuple (kind, copies, value) where copies is the number of
+  copies, or None for a single die, and kind and value are one of:
+    'const':  An integer constant.
+    'die':    The number of sides of a fair die.
+    'seq':    A list of the number of sides of fair dice to sum.
+    'pool':   None, for the pool die.
+    'list':   A list of relative probabilities where the index is the
+              outcome.
 
   Arguments:
-    makedie:    The class of die to create.
     raw:        The input string that describes the die.
     max_sides:  Maximum number of sides a die may have in the input.
                 None for infinite, the default.
     max_dice:   Maximum number of dice described in the input.
                 None for infinite, the default.
+
+  Returns a tuple with the terms and the whitespace separated parts of the
+  input.
   """
   rawdice = raw.split()
-  if len(rawdice) == 0:
-    return (None,rawdice)
 
   countdice = DiceCounter(max_dice).count
   readsides = SideReader(max_sides).read
-  
-  # Place-holder die that always rolls a sum of 0
-  die = makedie.const(0)
 
-  # For each proposed die
+  terms = []
   for rd in rawdice:
-    # Check for constants
-    m = _RE_CONST.match(rd)
-    if m:
-      die += makedie.const(readsides(m.group(1)))
-      continue
-    
-    # Check for single die
-    m = _RE_SINGLE.match(rd)
-    if m:
-      countdice(1)
-      die += makedie(readsides(m.group(1)))
-      continue
-    
-    # Check for multiple copies of same die
-    m = _RE_MULTI.match(rd)
-    if m:
-      copies = int(m.group(1))
-      sides = readsides(m.group(2))
-
-      countdice(copies)
-
-      die += makedie(sides).duplicate(copies)
-      continue
+    m = _RE_TERM.match(rd)
+    if m is None:
+      raise DieParseException("Invalid die: %s"%rd)
+    g = m.groupdict()
+
+    if g['const'] is not None:
+      terms.append(('const',None,readsides(g['const'])))
+
+    elif g['sides'] is not None:
+      copies = _copies(g['copies'])
+      if copies is None:
+        countdice(1)
+        sides = readsides(g['sides'])
+      else:
+        sides = readsides(g['sides'])
+        countdice(copies)
+      terms.append(('die',copies,sides))
 
-    # Check for die sequences
-    m = _RE_SEQ.match(rd)
-    if m:
+    elif g['seq_start'] is not None:
       try:
-        start = _DIE_SEQ.index( int(m.group(1)) )
-        stop = _DIE_SEQ.index( int(m.group(2)) )
+        start = _DIE_SEQ.index( int(g['seq_start']) )
+        stop = _DIE_SEQ.index( int(g['seq_stop']) )
         if start>stop:
           raise ValueError()
       except ValueError:
         raise DieParseException("Invalid die sequence: %s"%rd)
 
       countdice(stop+1-start)
+      terms.append(('seq',None,_DIE_SEQ[start:stop+1]))
 
-      die += makedie([ makedie(n) for n in _DIE_SEQ[start:stop+1] ])
+    elif g['pool'] is not None:
+      copies = _copies(g['pool'])
+      countdice(1 if copies is None else copies)
+      readsides(3)
+      terms.append(('pool',copies,None))
 
-      continue
+    else:
+      copies = _copies(g['list_copies'])
+      prob = [ int(p) for p in g['list'].split(',') ]
 
-    # Check for a pool die
-    m = _RE_POOL.match(rd)
-    if m:
-      try:
-        copies = int(m.group(1))
-      except ValueError:
-        copies = 1
+      countdice(1 if copies is None else copies)
+      readsides(len(prob))
+      if sum(prob) == 0:
+        raise DieParseException("Invalid die: %s"%rd)
+      terms.append(('list',copies,prob))
+
+  return (terms,rawdice)
+
+def build_term(makedie,term):
+  """Create the die of a term from parse_terms()."""
+  (kind,copies,value) = term
+  if kind == 'const':
+    return makedie.const(value)
+  elif kind == 'seq':
+    return makedie([ makedie(n) for n in value ])
+  elif kind == 'pool':
+    die = makedie(_POOL_DIE)
+  else:
+    die = makedie(value)
+
+  if copies is None:
+    return die
+  return die.duplicate(copies)
+
+def _base_terms(term):
+  """
+  Split a term into its base dice and the number of copies of each. The base
+  dice are described by (kind, value) with kind and value as for terms.
+  """
+  (kind,copies,value) = term
+  if copies is None:
+    copies = 1
 
-      countdice(copies)
-      readsides(3)
+  if kind == 'seq':
+    return [ (('die',n),copies) for n in value ]
+  elif kind == 'list':
+    return [ (('list',tuple(value)),copies) ]
+  return [ ((kind,value),copies) ]
 
-      die += makedie(_POOL_DIE).duplicate(copies)
+def build_terms(makedie,terms):
+  """
+  Create the dice of terms from parse_terms(), to be summed. Copies of the
+  same base die in different terms are merged, so that each base die is
+  duplicated once.
+  """
+  order = []
+  copies = {}
+  dice = []
+  for term in terms:
+    if term[0] == 'const':
+      # Constants are limited by max_sides, so they are kept apart.
+      dice.append(build_term(makedie,term))
       continue
 
-    # Check for a list of probabilities
-    m = _RE_LIST.match(rd)
-    if m:
-      try:
-        copies = int(m.group(1))
-      except ValueError:
-        copies = 1
-      try:
-        prob = [int(p) for p in m.group(2).split(',')]
-      except ValueError:
-        raise DieParseException("Invalid die: %s"%rd)
+    for (base,n) in _base_terms(term):
+      if base not in copies:
+        order.append(base)
+        copies[base] = 0
+      copies[base] += n
 
-      countdice(copies)
-      readsides(len(prob))
+  for base in order:
+    (kind,value) = base
+    if kind == 'list':
+      value = list(value)
+    dice.append(build_term(makedie,(kind,copies[base],value)))
+  return dice
 
-      try:
-        die += makedie(prob).duplicate(copies)
-      except ValueError:
-        raise DieParseException("Invalid die: %s"%rd)
-      continue
+def from_string(makedie,raw,max_sides=None,max_dice=None):
+  """
+  Create the composite die described in the string. Results, including
+  parse errors, are cached in parse_cache, so repeated descriptions are
+  neither parsed nor computed again. Each call gets its own LazyDie, since
+  collapsing changes it.
 
-    # None of the above matched; the die is invalid.
-    raise DieParseException("Invalid die: %s"%rd)
-    
-  return (die,rawdice)
+  Arguments:
+    makedie:    The class of die to create.
+    raw:        The input string that describes the die.
+    max_sides:  Maximum number of sides a die may have in the input.
+                None for infinite, the default.
+    max_dice:   Maximum number of dice described in the input.
+                None for infinite, the default.
+  """
+  (ok,result) = parse_cache.lookup(
+    (raw,max_sides,max_dice,makedie),
+    lambda: _from_string(makedie,raw,max_sides,max_dice))
+  if not ok:
+    raise DieParseException(*result)
+
+  (die,rawdice) = result
+  if type(die) is tuple:
+    die = LazyDie(list(die))
+  return (die,list(rawdice))
+
+def _from_string(makedie,raw,max_sides,max_dice):
+  """
+  Create the die described in the string, see from_string(). Returns
+  (True, (die, rawdice)) on success and (False, args) with the arguments of
+  the DieParseException on failure. A LazyDie is returned as the tuple of its
+  base dice and copies, which is not changed by collapsing.
+  """
+  try:
+    (terms,rawdice) = parse_terms(raw,max_sides,max_dice)
+  except DieParseException as e:
+    return (False,e.args)
+
+  if len(rawdice) == 0:
+    return (True,(None,tuple(rawdice)))
+
+  die = fastsum(build_terms(makedie,terms))
+  if isinstance(die,LazyDie):
+    die = tuple(die._dice)
+  return (True,(die,tuple(rawdice)))
 
 _RE_RANGE = re.compile('^(\d+)-(\d+)$')
 
 class PoolBuilder(object):
+  """Build dice pools, checking the number of dice in each pool."""
+
   def __init__(self,makedie,max_dice=None):
+    """
+    Arguments:
+      makedie:    The class of die to create.
+      max_dice:   Maximum number of dice in a pool.
+                  None for infinite, the default.
+    """
     self.makedie = makedie
     self.counter = DiceCounter(max_dice)
-    self.dice = []
-    self.rawdice = []
 
-  def add(self,copies):
+  def build(self,beg,end):
+    """
+    Generate the pools with beg up to end dice as (die, raw) pairs. Each pool
+    is computed from the previous one by adding a single pool die.
+    """
     self.counter.reset()
-    self.counter.count(copies)
-    self.dice.append(self.makedie(_POOL_DIE).duplicate(copies))
-    self.rawdice.append(str(copies))
+    self.counter.count(end)
+    for (copies,die) in enumerate(_duplicates(_POOL_DIE,beg,end),beg):
+      if self.makedie is LazyDie:
+        # The pool is in duplicate_cache now, for the lazy die to find.
+        die = LazyDie(_POOL_DIE).duplicate(copies)
+      yield (die, str(copies))
+
+def _duplicates(die,beg,end):
+  """
+  Generate die.duplicate(num) for num from beg up to end, adding a single die
+  to the previous result for each step. The results are stored in
+  duplicate_cache.
+  """
+  key = die._key()
+  current = die.duplicate(beg)
+  yield current
+  for num in xrange(beg+1,end+1):
+    if num == 1:
+      current = die
+    else:
+      current = duplicate_cache.lookup(
+        (key,num), lambda: (current + die)._freeze())
+    yield current
 
-def pool_from_string(makedie,raw,max_dice=None):
+def iter_pool_from_string(makedie,raw,max_dice=None):
   """
-  Create the list of dice pools described in the string.
+  Generate the dice pools described in the string as (die, raw) pairs. Pools
+  are created one at a time, so the first ones are available before the last
+  ones are computed. Invalid input raises DieParseException once it is
+  reached.
 
   Arguments:
     makedie:    The class of die to create.
@@ -443,17 +822,33 @@ def pool_from_string(makedie,raw,max_dice=None):
           raise ValueError()
         if end-beg+1>30:
           raise DieParseException("Max allowed range length is 30.")
-        for copies in range(beg,end+1):
-          pools.add(copies)
       else:
-        copies = int(r)
-        if copies<0:
+        beg = end = int(r)
+        if beg<0:
           raise ValueError()
-        pools.add(copies)
     except ValueError:
       raise DieParseException("Invalid dice: %s"%r)
-    
-  return (pools.dice,pools.rawdice)
+
+    for pool in pools.build(beg,end):
+      yield pool
+
+def pool_from_string(makedie,raw,max_dice=None):
+  """
+  Create the list of dice pools described in the string.
+
+  Arguments:
+    makedie:    The class of die to create.
+    raw:        The input string that describes the die.
+    max_dice:   Maximum number of dice described in the input.
+                None for infinite, the default.
+  """
+  dice = []
+  rawdice = []
+  for (d,r) in iter_pool_from_string(makedie,raw,max_dice):
+    dice.append(d)
+    rawdice.append(r)
+
+  return (dice,rawdice)
 
 class LazyDie(object):
   """A lazy implementation of a die."""
@@ -494,21 +889,71 @@ class LazyDie(object):
 
   @inheritdoc(Die)
   def max_side(self):
-    return sum(d.max_side() for (d,n) in self._dice)
+    return sum(d.max_side()*n for (d,n) in self._dice)
+
+  @inheritdoc(Die)
+  def min_side(self):
+    return sum(d.min_side()*n for (d,n) in self._dice)
+
+  @inheritdoc(Die)
+  def prune(self,epsilon):
+    return LazyDie([ (d.prune(epsilon),n) for (d,n) in self._dice ])
+
+  @inheritdoc(Die)
+  def error(self):
+    return self.collapsed().error()
+
+  def _key(self):
+    """
+    Get a canonical, hashable key for the lazily described dice: the keys of
+    the base dice sorted, together with the number of copies of each.
+    """
+    counts = {}
+    for (d,n) in self._dice:
+      k = d._key()
+      counts[k] = counts.get(k,0) + n
+    return tuple(sorted(counts.items()))
+
+  def canonical(self):
+    """
+    Get a canonical description of the die that from_string() accepts. Dice
+    made up of the same base dice, in any order and grouping, get the same
+    description. Returns None if a base die has no exact integer weights.
+    """
+    dice = {}
+    for (d,n) in self._dice:
+      if not d.is_exact():
+        return None
+      k = d._key()
+      dice[k] = (d, dice.get(k,(d,0))[1] + n)
+
+    terms = []
+    for k in sorted(dice, key=lambda k: (len(k[1]),k)):
+      terms += _canonical_terms(*dice[k])
+    return string.join(terms) or '0'
 
   def collapse(self):
-    """Collapse the lazy die into a single die. Do all the heavy computation."""
+    """
+    Collapse the lazy die into a single die. Do all the heavy computation,
+    unless an equivalent die is found in collapse_cache.
+    """
     if len(self._dice)>1 or self._dice[0][1]>1:
-      self._dice.sort(reverse=True)
+      with timing.phase('collapse'):
+        die = collapse_cache.lookup(self._key(), self._collapse)
+      self._dice = [(die,1)]
+
+  def _collapse(self):
+    """Combine all lazily described dice into a single, shareable die."""
+    self._dice.sort(reverse=True)
 
-      dice = []
-      while len(self._dice)>0:
-        (d,n) = self._dice.pop()
-        while len(self._dice)>0 and self._dice[-1][0]==d:
-          n += self._dice.pop()[1]
-        dice.append(d.duplicate(n))
+    dice = []
+    while len(self._dice)>0:
+      (d,n) = self._dice.pop()
+      while len(self._dice)>0 and self._dice[-1][0]==d:
+        n += self._dice.pop()[1]
+      dice.append(d.duplicate(n))
 
-      self._dice = [(fastsum(dice),1)]
+    return fastsum(dice)._freeze()
 
   def collapsed(self):
     """Get the collapsed die, all lazily described dice combined into one."""
@@ -529,10 +974,18 @@ class LazyDie(object):
   def probability(self,*args,**kwargs):
     return self.collapsed().probability(*args,**kwargs)
 
+  @inheritdoc(Die)
+  def probability_array(self,*args,**kwargs):
+    return self.collapsed().probability_array(*args,**kwargs)
+
   @inheritdoc(Die)
   def probability_reach(self,*args,**kwargs):
     return self.collapsed().probability_reach(*args,**kwargs)
 
+  @inheritdoc(Die)
+  def probability_reach_array(self,*args,**kwargs):
+    return self.collapsed().probability_reach_array(*args,**kwargs)
+
   @inheritdoc(Die)
   def probability_vs(self,other,*args,**kwargs):
     return self.collapsed().probability_vs(other.collapsed(),*args,**kwargs)
@@ -545,10 +998,57 @@ class LazyDie(object):
   def roll(self,*args,**kwargs):
     return self.collapsed().roll(*args,**kwargs)
 
+  @inheritdoc(Die)
+  def sampler(self,*args,**kwargs):
+    return self.collapsed().sampler(*args,**kwargs)
+
+  @inheritdoc(Die)
+  def roll_many(self,*args,**kwargs):
+    return self.collapsed().roll_many(*args,**kwargs)
+
   @inheritdoc(Die)
   def percentile_reach(self,*args,**kwargs):
     return self.collapsed().percentile_reach(*args,**kwargs)
 
+# Process wide cache of collapsed lazy dice, keyed by LazyDie._key(). Use
+# collapse_cache.configure() to change its limits and collapse_cache.stats()
+# for monitoring.
+collapse_cache = LRUCache(
+  max_entries=256, max_bytes=64*1024*1024, sizeof=Die._nbytes)
+
+# Process wide cache of duplicated dice, keyed by the key of the base die and
+# the number of copies. Powers of 2 stored here are reused by later
+# duplications of the same die.
+duplicate_cache = LRUCache(
+  max_entries=1024, max_bytes=64*1024*1024, sizeof=Die._nbytes)
+
+def _parse_nbytes(result):
+  (ok,value) = result
+  if ok and isinstance(value[0],Die):
+    return value[0]._nbytes()
+  return 0
+
+# Process wide cache of from_string() results, keyed by the input string, the
+# limits and the class of die.
+parse_cache = LRUCache(
+  max_entries=1024, max_bytes=16*1024*1024, sizeof=_parse_nbytes)
+
+def _canonical_terms(die,copies):
+  """Describe copies of an exact die as terms accepted by from_string()."""
+  counts = (0,)*die._offset + die._counts
+  sides = len(counts) - 1
+  prefix = str(copies) if copies>1 else ''
+
+  if die._denom == 1:
+    # A constant; constants are limited by max_sides, so they are not merged.
+    return [str(sides)]*copies if sides>0 else []
+  elif counts == (0,) + (1,)*sides:
+    return ['%sd%d'%(prefix,sides)]
+  elif die._key() == _POOL_DIE._key():
+    return ['%sp'%prefix]
+  else:
+    return ['%s[%s]'%(prefix,string.join(map(str,counts),','))]
+
 class DieQueue(AbstractQueue):
   def priority(self,obj):
     return obj.max_side()
@@ -567,3 +1067,63 @@ def fastsum(dice):
     die += dieq.pop()
 
   return die
+
+def collapse_many(dice):
+  """
+  Collapse many lazy dice in one go and return the collapsed dice. Dice made
+  up of the same base dice are collapsed once, and each duplication of a base
+  die is computed once and shared by all dice that use it.
+  """
+  groups = {}
+  bases = {}
+  for d in dice:
+    groups.setdefault(d._key(),[]).append(d)
+    for (b,n) in d._dice:
+      bases[b._key()] = b
+
+  duplicates = {}
+  def duplicate(key,num):
+    if (key,num) not in duplicates:
+      duplicates[(key,num)] = bases[key].duplicate(num)
+    return duplicates[(key,num)]
+
+  for (key,same) in groups.items():
+    die = collapse_cache.lookup(key,
+      lambda: fastsum([ duplicate(k,n) for (k,n) in key ])._freeze())
+    for d in same:
+      d._dice = [(die,1)]
+
+  return [ d.collapsed() for d in dice ]
+
+def versus_matrix(dice):
+  """
+  Compute the outcome of every die against every other die in one batch.
+  Returns the matrices (win, tie, loss), where win[i][j] is the probability
+  that dice[i] rolls higher than dice[j], tie[i][j] that they roll the same
+  and loss[i][j] that dice[i] rolls lower. The matrices are NumPy arrays, or
+  lists of lists if NumPy is not available.
+
+  Arguments:
+    dice:   A list of dice, either Die or LazyDie.
+  """
+  if numpy is None:
+    win = [ [ a.probability_vs(b) for b in dice ] for a in dice ]
+    tie = [ [ a.probability_eq(b) for b in dice ] for a in dice ]
+    loss = [ list(col) for col in zip(*win) ]
+    return (win,tie,loss)
+
+  size = max([ d.max_side() for d in dice ] + [0]) + 2
+
+  # Probabilities and reach padded with zeros, one die per row.
+  prob = numpy.zeros((len(dice),size))
+  reach = numpy.zeros((len(dice),size))
+  for (i,d) in enumerate(dice):
+    p = d.probability_array()
+    prob[i,:len(p)] = p
+    r = d.probability_reach_array()
+    reach[i,:len(r)] = r
+
+  # Die i beats die j if it reaches at least one more than j rolled.
+  win = numpy.dot(reach[:,1:], prob[:,:-1].T)
+  tie = numpy.dot(prob, prob.T)
+  return (win,tie,win.T)
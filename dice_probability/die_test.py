@@ -1,7 +1,12 @@
 from dice_probability.die import Die, LazyDie
 from dice_probability.die import DieParseException, from_string, pool_from_string, fastsum
+from dice_probability.die import collapse_cache, duplicate_cache, iter_pool_from_string
+from dice_probability.die import versus_matrix, percentiles_from_reach, collapse_many
+from dice_probability.die import parse_terms, parse_cache
 from django.test import TestCase
 
+import sys
+
 class TestDie(TestCase):
 
   def test_init(self):
@@ -93,6 +98,7 @@ class TestDie(TestCase):
       self.assertEqual(d(8).duplicate(3), d(8)+d(8)+d(8))
 
       self.assertEquals(d(5).duplicate(20), d(5)+d(5).duplicate(19))
+      self.assertEquals(d(5).duplicate(20).max_side(), 100)
 
       a = (d(5) + d(10)).duplicate(3)
       b = d(5).duplicate(3) + d(10).duplicate(3)
@@ -109,6 +115,30 @@ class TestDie(TestCase):
     for d in (Die,LazyDie):
       self.assertEquals(d(4).probability_reach(),[1.0,1.0,0.75,0.5,0.25])
 
+  def test_probability_arrays(self):
+    for d in (Die,LazyDie):
+      die = d(4)
+      self.assertEquals(list(die.probability_array()),die.probability())
+      self.assertEquals(
+          list(die.probability_reach_array()),[1.0,1.0,0.75,0.5,0.25])
+      self.assertEquals(
+          list(die.probability_reach_array(padded=True)),
+          [1.0,1.0,0.75,0.5,0.25,0.0])
+      self.assertTrue(
+          die.probability_reach_array() is not die.probability_reach())
+
+      def assign(array):
+        array[0] = 0.5
+      self.assertRaises(
+          (ValueError,TypeError),assign,die.probability_reach_array())
+      self.assertRaises(
+          (ValueError,TypeError),assign,die.probability_array())
+
+    self.assertEquals(
+        list(Die([0,1,1]).probability_reach_array()),[1.0,1.0,0.5])
+    self.assertEquals(
+        list(Die([0,0.5,0.5]).probability_reach_array()),[1.0,1.0,0.5])
+
   def test_probability_vs(self):
     for d in (Die,LazyDie):
       p = 0.5*0.75 + 0.5*0.5
@@ -145,6 +175,14 @@ class TestDie(TestCase):
       self.assertRaises(ValueError,d(10).roll,-0.2)
       self.assertRaises(ValueError,d(10).roll,1.0)
 
+  def test_roll_many(self):
+    for d in (Die,LazyDie):
+      die = d(4)+d(6)
+      rolls = die.roll_many(1000)
+      self.assertEquals(len(rolls),1000)
+      self.assertTrue(all(2 <= r <= 10 for r in rolls))
+      self.assertTrue(die.sampler() is die.sampler())
+
   def test_from_string(self):
     for d in (Die,LazyDie):
       self.assertEquals(from_string(d,""),(None,[]))
@@ -160,6 +198,10 @@ class TestDie(TestCase):
           from_string(d,"d4-d20"),
           (d(4) + d(6) + d(8) + d(10) + d(12) + d(20),["d4-d20"]))
 
+      self.assertEquals(
+          from_string(d,"d6 2d6 d4-d6 3")[0],
+          d(4) + d(6).duplicate(4) + d.const(3))
+
       self.assertRaises(DieParseException,from_string,d,"12e3")
       self.assertRaises(DieParseException,from_string,d,"h")
       self.assertRaises(DieParseException,from_string,d,"3d3d2")
@@ -186,6 +228,215 @@ class TestDie(TestCase):
       self.assertEquals(from_string(d,"3p p"),(pool.duplicate(3) + pool,["3p","p"]))
       self.assertEquals(from_string(d,"3p d4"),(pool.duplicate(3) + d(4),["3p","d4"]))
 
+  def test_parse_terms(self):
+    self.assertEquals(parse_terms(""),([],[]))
+    self.assertEquals(
+        parse_terms("3 d6 2D8 d4-d8 2p [1,2]"),
+        ([('const',None,3), ('die',None,6), ('die',2,8),
+          ('seq',None,[4,6,8]), ('pool',2,None), ('list',None,[1,2])],
+         ["3","d6","2D8","d4-d8","2p","[1,2]"]))
+
+    self.assertRaises(DieParseException,parse_terms,"[0,0]")
+    self.assertRaises(DieParseException,parse_terms,"d8-d4")
+    self.assertRaises(DieParseException,parse_terms,"1000000d6",max_dice=15)
+
+    # The limits are checked in the same order as when dice were built
+    # while parsing.
+    for (raw,message) in [("10d6 d31","Only 10 dice are allowed."),
+                          ("11[0,0]","Only 10 dice are allowed."),
+                          ("10d6 [0,0]","Only 10 dice are allowed."),
+                          ("[0,0]","Invalid die: [0,0]"),
+                          ("11d31","Max 30 sides for a die")]:
+      try:
+        parse_terms(raw,max_sides=30,max_dice=10)
+        self.fail(raw)
+      except DieParseException as e:
+        self.assertEquals(e.args[0],message)
+
+  def test_parse_cache(self):
+    parse_cache.clear()
+    (a,raw) = from_string(Die,"2d6 d4")
+    raw.append("modified")
+    (b,raw) = from_string(Die,"2d6 d4")
+    self.assertTrue(a is b)
+    self.assertEquals(raw,["2d6","d4"])
+    self.assertFalse(from_string(LazyDie,"2d6 d4")[0] is a)
+    self.assertFalse(from_string(Die,"2d6 d4",max_dice=5)[0] is a)
+
+    for i in range(2):
+      self.assertRaises(DieParseException,from_string,Die,"3d6",max_dice=2)
+
+    stats = parse_cache.stats()
+    self.assertEquals(stats['hits'],2)
+    self.assertEquals(stats['misses'],4)
+
+    # Collapsing a lazy die does not change the cached result.
+    (lazy,raw) = from_string(LazyDie,"3d10")
+    lazy.collapse()
+    (again,raw) = from_string(LazyDie,"3d10")
+    self.assertFalse(again is lazy)
+    self.assertEquals(again.canonical(),"3d10")
+    self.assertEquals(again._dice,[(Die(10),3)])
+
+  def test_prune(self):
+    six = Die(6)
+    self.assertTrue(six.prune(0.0) is six)
+    self.assertEquals(six.error(),0.0)
+
+    die = Die([1,2,94,2,1]).prune(0.06)
+    self.assertEquals(die.probability(),[0.0,0.0,0.94])
+    self.assertAlmostEqual(die.error(),0.06)
+
+    full = Die(30).duplicate(20)
+    for d in (Die,LazyDie):
+      pruned = d(30).prune(1e-12).duplicate(20)
+      self.assertTrue(0.0 < pruned.error() < 20*1e-12)
+      self.assertTrue(pruned.max_side() < full.max_side())
+      for (p,q) in zip(pruned.probability(),full.probability()):
+        self.assertTrue(abs(p-q) <= pruned.error())
+
+    # Pruning carries over to sums, and the errors add up.
+    a = Die([1,2,94,2,1]).prune(0.06)
+    b = a + Die(2)
+    self.assertAlmostEqual(b.error(),a.error())
+    self.assertNotEqual(a._key(),Die([0,0,94])._key())
+
+    # Rolls only use the remaining probability.
+    self.assertEquals(a.roll(0.0),2)
+    self.assertEquals(a.roll(0.99),2)
+    self.assertEquals(LazyDie(30).prune(1e-3).duplicate(10).roll(0.99999999),
+      241)
+
+  def test_offset(self):
+    self.assertEquals(len(Die.const(30)._sides),1)
+    self.assertEquals(len(Die(6).duplicate(10)._sides),51)
+    self.assertEquals(len(Die([0,0,0.5,0.5])._sides),2)
+
+    for d in (Die,LazyDie):
+      die = d(6) + d.const(30)
+      self.assertEquals((die.min_side(),die.max_side()),(31,36))
+      self.assertEquals(die.probability(),[0.0]*31 + [1.0/6]*6)
+      self.assertEquals(list(die.probability_array()),die.probability())
+      self.assertEquals(list(die.probability_reach_array()),
+          [1.0]*32 + [5.0/6,4.0/6,3.0/6,2.0/6,1.0/6])
+      self.assertEquals(die.percentile_reach([1.0,0.5,0.0]),[31.0,34.0,36.0])
+      self.assertEquals(die.roll(0.99),36)
+      self.assertTrue(all(31 <= r <= 36 for r in die.roll_many(100)))
+
+    self.assertRaises(ValueError,Die.const,-1)
+
+  def test_exact(self):
+    self.assertTrue(Die(6).is_exact())
+    self.assertTrue(Die([0,2,2]).is_exact())
+    self.assertTrue(Die([0.0,1,1]).is_exact())
+    self.assertTrue(Die.const(3).is_exact())
+    self.assertFalse(Die([0,0.5,0.5]).is_exact())
+
+    self.assertEquals(Die([0,2,2,0])._key(),Die(2)._key())
+    self.assertEquals((Die(2)+Die(2))._key(),('exact',(1,2,1),4,2))
+    self.assertNotEqual(Die.const(0)._key(),Die([0,0.5])._key())
+
+    # Exact and inexact dice with similar keys are not mixed up in caches.
+    from_string(LazyDie,"0 0")[0].collapse()
+    (d,raw) = from_string(LazyDie,"2[0,99999999999999999999]")
+    self.assertEquals(d.probability(),[0.0,0.0,1.0])
+    self.assertEquals(Die(2)+Die(4),Die(4)+Die(2))
+    self.assertEquals(Die([0,2,2]),Die([0,0.5,0.5]))
+
+    die = Die(6).duplicate(10)
+    self.assertTrue(die.is_exact())
+    self.assertEquals((die._counts[50],die._denom,die.min_side()),(1,6**10,10))
+
+    self.assertFalse(Die(30).duplicate(15).is_exact())
+    self.assertFalse((Die(2)+Die([0,0.5,0.5])).is_exact())
+
+  def test_nbytes(self):
+    # The size covers the arrays and sampler built when the die is used.
+    for die in (Die(6).duplicate(5), Die(30).duplicate(20)+Die(7)):
+      die.probability_reach_array()
+      die.probability_array()
+      sampler = die.sampler()
+      used = sum(a.nbytes for a in
+        (die._sides,die._reach,die._reach_keys,die._dense))
+      used += sum(sys.getsizeof(l) + 24*len(l) for l in
+        (sampler._outcomes,sampler._prob,sampler._alias))
+      self.assertTrue(die._nbytes() >= used)
+
+  def test_collapse_cache(self):
+    a = LazyDie(6).duplicate(3)
+    b = LazyDie(6) + LazyDie(6).duplicate(2)
+    c = LazyDie(6) + LazyDie(4)
+    d = LazyDie(4) + LazyDie(6)
+
+    self.assertEquals(a._key(),b._key())
+    self.assertEquals(c._key(),d._key())
+    self.assertNotEqual(a._key(),c._key())
+
+    collapse_cache.clear()
+    self.assertTrue(a.collapsed() is b.collapsed())
+    self.assertTrue(c.collapsed() is d.collapsed())
+    self.assertEquals(a.collapsed(),Die(6).duplicate(3))
+
+    stats = collapse_cache.stats()
+    self.assertEquals(stats['hits'],2)
+    self.assertEquals(stats['misses'],2)
+
+  def test_duplicate_cache(self):
+    duplicate_cache.clear()
+    five = Die(6).duplicate(5)
+    key = Die(6)._key()
+    self.assertEquals(len(duplicate_cache),3)
+    for n in (2,4,5):
+      self.assertTrue((key,n) in duplicate_cache)
+
+    seven = Die(6).duplicate(7)
+    self.assertTrue(Die(6).duplicate(4) is Die(6).duplicate(4))
+    self.assertTrue((key,7) in duplicate_cache)
+    self.assertEquals(duplicate_cache.stats()['misses'],4)
+    self.assertEquals(seven,five+Die(6)+Die(6))
+
+  def test_versus_matrix(self):
+    for d in (Die,LazyDie):
+      dice = [d(4), d(6)+d(2), d.const(3), d(20), d(6).duplicate(3)]
+      (win,tie,loss) = versus_matrix(dice)
+      for (i,a) in enumerate(dice):
+        for (j,b) in enumerate(dice):
+          self.assertEquals(round(win[i][j]-a.probability_vs(b),12),0.0)
+          self.assertEquals(round(tie[i][j]-a.probability_eq(b),12),0.0)
+          self.assertEquals(round(loss[i][j]-b.probability_vs(a),12),0.0)
+          self.assertEquals(round(win[i][j]+tie[i][j]+loss[i][j],12),1.0)
+
+    self.assertEquals(len(versus_matrix([])[0]),0)
+
+  def test_canonical(self):
+    for raw in ("3d6","d6 d6 d6","1d6 2d6","d6 [0,1,1,1,1,1,1] d6"):
+      self.assertEquals(from_string(LazyDie,raw)[0].canonical(),"3d6")
+
+    self.assertEquals(
+        from_string(LazyDie,"d12 d10 d8 d6 d4")[0].canonical(),
+        from_string(LazyDie,"d4-d12")[0].canonical())
+    self.assertEquals(from_string(LazyDie,"p 4p")[0].canonical(),"5p")
+    self.assertEquals(from_string(LazyDie,"13 2 13")[0].canonical(),"2 13 13")
+    self.assertEquals(from_string(LazyDie,"2[1,0,2]")[0].canonical(),"2[1,0,2]")
+    self.assertEquals(from_string(LazyDie,"0")[0].canonical(),"0")
+    self.assertEquals(LazyDie([0,0.5,0.5]).canonical(),None)
+
+    for raw in ("d4 2d6 3","d4-d20 p 2[1,0,2]","20 20 d20"):
+      die = from_string(LazyDie,raw)[0]
+      self.assertEquals(from_string(LazyDie,die.canonical())[0],die)
+
+  def test_collapse_many(self):
+    raws = ["3d6 d8", "d6 2d6 d8", "3d6 d10", "d20"]
+    dice = [ from_string(LazyDie,r)[0] for r in raws ]
+
+    collapse_cache.clear()
+    collapsed = collapse_many(dice)
+    self.assertEquals(len(collapse_cache),3)
+    self.assertTrue(collapsed[0] is collapsed[1])
+    for (r,c) in zip(raws,collapsed):
+      self.assertEquals(c,from_string(Die,r)[0])
+    self.assertEquals(collapse_many([]),[])
+
   def test_fastsum(self):
     self.assertEquals(fastsum([Die(10)]), Die(10))
     self.assertEquals(fastsum([Die(4),Die(6)]), Die(4)+Die(6))
@@ -216,6 +467,20 @@ class TestDie(TestCase):
       self.assertRaises(DieParseException, pool_from_string, d, "3-2")
       self.assertRaises(DieParseException, pool_from_string, d, "1-31")
 
+  def test_iter_pool_from_string(self):
+    pool = Die([7,4,1])
+    pools = iter_pool_from_string(Die,"2-4 1 x")
+    self.assertEquals(next(pools),(pool.duplicate(2),"2"))
+    self.assertEquals(next(pools),(pool.duplicate(3),"3"))
+    self.assertEquals(next(pools),(pool.duplicate(4),"4"))
+    self.assertEquals(next(pools),(pool,"1"))
+    self.assertRaises(DieParseException,next,pools)
+
+    duplicate_cache.clear()
+    pool_from_string(Die,"1-30")
+    for n in range(2,31):
+      self.assertTrue((pool._key(),n) in duplicate_cache)
+
   def test_percentile_reach(self):
     for d in (Die,LazyDie):
       self.assertEquals(d(4).percentile_reach([0.5]),[3.0])
@@ -243,3 +508,8 @@ class TestDie(TestCase):
       self.assertEquals(round(d(10).percentile_reach([0.75])[0],7),3.5)
 
       self.assertEquals(d(4).percentile_reach([0.75,0.5,0.25]),[2.0, 3.0, 4.0])
+      self.assertEquals(d(4).percentile_reach([0.25,1.0,0.5]),[4.0, 1.0, 3.0])
+      self.assertEquals(d(4).percentile_reach([]),[])
+
+    keys = [-1.0,-1.0,-0.75,-0.5,-0.25,0.0]
+    self.assertEquals(percentiles_from_reach(keys,[0.5,0.625]),[3.0,2.5])
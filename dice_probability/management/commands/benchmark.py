@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from dice_probability import benchmark
+
+from optparse import make_option
+import json
+
+class Command(BaseCommand):
+  args = '[benchmark ...]'
+  help = 'Run the benchmarks, or the given ones, and print the results as JSON.'
+
+  option_list = BaseCommand.option_list + (
+    make_option('--repeat', type='int', default=10,
+      help='Number of times to run each benchmark.'),
+    make_option('--list', action='store_true', default=False,
+      help='List the benchmarks instead of running them.'),
+  )
+
+  def handle(self,*names,**options):
+    if options['list']:
+      for (name,setup) in benchmark.BENCHMARKS:
+        self.stdout.write(name)
+      return
+
+    results = benchmark.run(options['repeat'],names)
+    self.stdout.write(json.dumps(results,indent=2,sort_keys=True))
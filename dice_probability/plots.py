@@ -0,0 +1,77 @@
+"""
+Render plots of dice distributions as PNG images with matplotlib. Importing
+this module is slow, so views import it only when a plot is requested.
+"""
+from django.http import HttpResponse
+
+import numpy as np
+
+from matplotlib import use as matplot_use
+matplot_use('cairo')
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.pyplot import Axes
+from dice_probability.boxplot import manual_boxplot
+from dice_probability.die import BOX_PERCENTILES
+from dice_probability import timing
+
+def _png_response(fig):
+  """Encode a figure as a PNG response."""
+  with timing.phase('encode'):
+    canvas = FigureCanvas(fig)
+    response = HttpResponse(content_type='image/png')
+    canvas.print_png(response)
+    return response
+
+@timing.timed('plot')
+def plot_prob(dice,target=False):
+  fig = Figure(figsize=(12, 6),frameon=False)
+  ax = Axes(fig,[0.07, 0.07, 0.77, 0.91])
+  fig.add_axes(ax)
+
+  for d in dice:
+    if target:
+      result = d.die.probability_reach_array(padded=True)
+    else:
+      result = d.die.probability_array()
+      result = np.append(result,0.0)
+
+    ax.plot(result,'-o',label=d.pri)
+  
+  ax.set_ylabel('Probability')
+  if target:
+    ax.set_xlabel('Target Sum')
+  else:
+    ax.set_xlabel('Sum')
+  ax.grid(True)
+
+  if dice:
+    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+
+  return _png_response(fig)
+
+@timing.timed('plot')
+def plot_box(dice):
+  fig = Figure(figsize=(12, 6),frameon=False)
+  ax = Axes(fig,[0.08, 0.07, 0.91, 0.91])
+  fig.add_axes(ax)
+
+  try:
+    boxes = [ d.die.percentile_reach(BOX_PERCENTILES) for d in reversed(dice) ]
+  except ValueError:
+    boxes = []
+
+  if boxes:
+    manual_boxplot(ax, boxes, vert=0)
+  else:
+    ax.plot([])
+
+  ax.set_yticklabels([ d.pri for d in reversed(dice) ])
+
+  ax.set_xlabel('Sum')
+
+  ax.grid(True)
+
+  return _png_response(fig)
+
@@ -0,0 +1,150 @@
+"""
+Render plots in a bounded pool of worker processes, so that CPU bound
+matplotlib rendering does not stall the threads serving requests. When the
+pool is saturated, or a plot takes too long, RenderUnavailable is raised so
+that the view can fail fast instead of queuing more work.
+
+The pool and its limit on pending plots are per process, so the site must be
+served by a single multithreaded process, such as runfcgi method=threaded.
+With prefork every child gets a pool of its own and serves one request at a
+time, so the limit never applies.
+"""
+from django.conf import settings
+from django.http import HttpResponse
+
+from dice_probability import timing
+
+from multiprocessing import Pool, TimeoutError
+from threading import Lock
+import importlib
+import os
+import traceback
+
+class RenderUnavailable(Exception):
+  """Raised when a plot can not be rendered right now."""
+  pass
+
+def _call(module,name,args):
+  """Call the named plot function and get the content and content type."""
+  response = getattr(importlib.import_module(module),name)(*args)
+  return (response.content,response['Content-Type'])
+
+def _run(module,name,args):
+  """
+  Call the named plot function in a worker and get the content and content
+  type of the response, and the timings of the call. Errors are returned
+  rather than raised, so that the pool always reports the job as done.
+  """
+  timings = timing.start()
+  try:
+    (content,content_type) = _call(module,name,args)
+    return (True,(content,content_type,timings.data()))
+  except Exception:
+    return (False,traceback.format_exc())
+  finally:
+    timing.finish()
+
+class RenderPool(object):
+  """Run plot functions in a pool of worker processes."""
+
+  def __init__(self,workers,max_pending,timeout):
+    """
+    Arguments:
+      workers:      Number of worker processes. With 0 plots are rendered in
+                    the calling thread, but max_pending still applies.
+      max_pending:  Maximum number of jobs queued or running at once. Further
+                    jobs are rejected.
+      timeout:      Seconds to wait for a job before giving up on it.
+    """
+    self.workers = workers
+    self.max_pending = max_pending
+    self.timeout = timeout
+    self.rejected = 0
+    self.timeouts = 0
+    self._lock = Lock()
+    self._pending = 0
+    self._pool = None
+    self._pid = None
+
+  def _get_pool(self):
+    """Get the pool of this process, started on first use and after forks."""
+    if self._pool is None or self._pid != os.getpid():
+      self._pool = Pool(self.workers)
+      self._pid = os.getpid()
+    return self._pool
+
+  def pending(self):
+    """Get the number of jobs queued or running."""
+    return self._pending
+
+  def render(self,module,name,*args):
+    """
+    Render a plot by calling the function name of module with args, and get
+    the response.
+
+    Raises RenderUnavailable if too many jobs are pending or if the job
+    times out.
+    """
+    with self._lock:
+      if self._pending >= self.max_pending:
+        self.rejected += 1
+        raise RenderUnavailable("Too many plots are being rendered.")
+      if self.workers > 0:
+        pool = self._get_pool()
+      self._pending += 1
+
+    # The job is no longer pending once it fails, times out or is done, even
+    # if a worker died or the arguments could not be sent to it.
+    try:
+      if self.workers == 0:
+        (content,content_type) = _call(module,name,args)
+        return HttpResponse(content,content_type=content_type)
+
+      with timing.phase('render'):
+        job = pool.apply_async(_run,(module,name,args))
+        try:
+          (ok,result) = job.get(self.timeout)
+        except TimeoutError:
+          with self._lock:
+            self.timeouts += 1
+          raise RenderUnavailable("Rendering the plot took too long.")
+    finally:
+      with self._lock:
+        self._pending -= 1
+
+    if not ok:
+      raise RuntimeError("Rendering failed in worker:\n%s"%result)
+
+    # Add the phases of the worker to those of the request.
+    (content,content_type,data) = result
+    timings = timing.current()
+    if timings is not None:
+      timings.merge(data)
+    return HttpResponse(content,content_type=content_type)
+
+  def stats(self):
+    """Get the counters of the pool."""
+    with self._lock:
+      return {
+        'workers': self.workers,
+        'pending': self._pending,
+        'rejected': self.rejected,
+        'timeouts': self.timeouts,
+      }
+
+_pool = None
+_pool_lock = Lock()
+
+def pool():
+  """
+  Get the render pool, configured by the PLOT_WORKERS, PLOT_MAX_PENDING and
+  PLOT_TIMEOUT settings.
+  """
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = RenderPool(
+        getattr(settings,'PLOT_WORKERS',0),
+        getattr(settings,'PLOT_MAX_PENDING',8),
+        getattr(settings,'PLOT_TIMEOUT',10))
+    return _pool
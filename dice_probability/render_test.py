@@ -0,0 +1,51 @@
+from dice_probability.render import RenderPool, RenderUnavailable
+from django.http import HttpResponse
+from django.test import TestCase
+
+import time
+
+def plot_text(text,seconds=0):
+  time.sleep(seconds)
+  return HttpResponse(text,content_type='text/plain')
+
+def plot_error():
+  raise ValueError("Broken plot")
+
+class TestRender(TestCase):
+  def test_inline(self):
+    pool = RenderPool(0,1,1)
+    response = pool.render('dice_probability.render_test','plot_text','abc')
+    self.assertEquals(response.content,'abc')
+    self.assertEquals(response['Content-Type'],'text/plain')
+    self.assertEquals(pool.pending(),0)
+
+  def test_workers(self):
+    pool = RenderPool(1,2,5)
+    response = pool.render('dice_probability.render_test','plot_text','abc')
+    self.assertEquals(response.content,'abc')
+    self.assertRaises(RuntimeError,
+      pool.render,'dice_probability.render_test','plot_error')
+    self.assertEquals(pool.pending(),0)
+
+  def test_saturated(self):
+    pool = RenderPool(0,0,1)
+    self.assertRaises(RenderUnavailable,
+      pool.render,'dice_probability.render_test','plot_text','abc')
+    self.assertEquals(pool.stats()['rejected'],1)
+
+  def test_timeout(self):
+    pool = RenderPool(1,1,0.1)
+    self.assertRaises(RenderUnavailable,
+      pool.render,'dice_probability.render_test','plot_text','abc',0.5)
+    self.assertEquals(pool.stats()['timeouts'],1)
+    self.assertEquals(pool.pending(),0)
+
+  def test_unpicklable(self):
+    # Jobs that can not be sent to a worker do not hold on to their slot.
+    pool = RenderPool(1,1,5)
+    for i in range(2):
+      self.assertRaises(Exception,pool.render,
+        'dice_probability.render_test','plot_text',lambda: None)
+      self.assertEquals(pool.pending(),0)
+    response = pool.render('dice_probability.render_test','plot_text','abc')
+    self.assertEquals(response.content,'abc')
@@ -0,0 +1,92 @@
+"""
+Sample outcomes of a discrete distribution in constant time per sample using
+Walker's alias method, as described by Vose.
+"""
+import random
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+class AliasSampler(object):
+  """Sample outcomes according to a list of probabilities."""
+
+  def __init__(self,probabilities):
+    """
+    Build the alias table for the probabilities, where the index is the
+    outcome. Only outcomes with a non-zero probability are put in the table.
+    """
+    outcomes = [ i for (i,p) in enumerate(probabilities) if p > 0.0 ]
+    if len(outcomes) == 0:
+      raise ValueError('Invalid probabilities.')
+
+    total = float(sum(probabilities[i] for i in outcomes))
+    size = len(outcomes)
+    scaled = [ probabilities[i]*size/total for i in outcomes ]
+
+    prob = [1.0]*size
+    alias = range(size)
+
+    small = [ i for (i,s) in enumerate(scaled) if s < 1.0 ]
+    large = [ i for (i,s) in enumerate(scaled) if s >= 1.0 ]
+
+    while small and large:
+      l = small.pop()
+      g = large.pop()
+      prob[l] = scaled[l]
+      alias[l] = g
+      scaled[g] += scaled[l] - 1.0
+      if scaled[g] < 1.0:
+        small.append(g)
+      else:
+        large.append(g)
+    # Entries left in either list are only off from 1 by rounding errors and
+    # keep the probability 1.0 to always pick themselves.
+
+    self._outcomes = outcomes
+    self._prob = prob
+    self._alias = alias
+
+    if numpy is not None:
+      self._outcomes_array = numpy.array(outcomes)
+      self._prob_array = numpy.array(prob)
+      self._alias_array = numpy.array(alias)
+
+  def sample(self,rnd=None):
+    """
+    Sample a single outcome. A random number in [0.0, 1.0) can be supplied,
+    otherwise one is generated.
+    """
+    if rnd is None:
+      rnd = random.random()
+
+    u = rnd*len(self._prob)
+    i = min(int(u), len(self._prob)-1)
+    if u-i < self._prob[i]:
+      return self._outcomes[i]
+    else:
+      return self._outcomes[self._alias[i]]
+
+  def sample_many(self,num,rng=None):
+    """
+    Sample num outcomes. Returns a NumPy array, or a list if NumPy is not
+    available.
+
+    Arguments:
+      num:    Number of outcomes to sample.
+      rng:    Random number generator with a random_sample() method, such as
+              numpy.random.RandomState. numpy.random by default.
+    """
+    if numpy is None:
+      if rng is None:
+        return [ self.sample() for _ in xrange(num) ]
+      return [ self.sample(rng.random_sample()) for _ in xrange(num) ]
+
+    if rng is None:
+      rng = numpy.random
+
+    u = rng.random_sample(num) * len(self._prob)
+    i = numpy.minimum(u.astype(numpy.intp), len(self._prob)-1)
+    chosen = numpy.where(u-i < self._prob_array[i], i, self._alias_array[i])
+    return self._outcomes_array[chosen]
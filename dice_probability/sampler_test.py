@@ -0,0 +1,35 @@
+from dice_probability.sampler import AliasSampler
+from django.test import TestCase
+import numpy
+
+class TestAliasSampler(TestCase):
+  def test_sample(self):
+    s = AliasSampler([0.0,0.5,0.5])
+    self.assertEquals(s.sample(0.0),1)
+    self.assertEquals(s.sample(0.49),1)
+    self.assertEquals(s.sample(0.51),2)
+    self.assertEquals(s.sample(0.999999),2)
+    self.assertTrue(s.sample() in (1,2))
+
+    s = AliasSampler([0.0,0.0,1.0,0.0])
+    for rnd in (0.0,0.3,0.7,0.999999):
+      self.assertEquals(s.sample(rnd),2)
+
+    self.assertRaises(ValueError,AliasSampler,[0.0,0.0])
+
+  def test_sample_many(self):
+    probabilities = [0.0,0.1,0.0,0.2,0.3,0.4]
+    s = AliasSampler(probabilities)
+
+    rolls = s.sample_many(100000,numpy.random.RandomState(0))
+    self.assertEquals(len(rolls),100000)
+
+    frequencies = numpy.bincount(rolls,minlength=6)/100000.0
+    self.assertEquals(frequencies[0],0.0)
+    self.assertEquals(frequencies[2],0.0)
+    for (f,p) in zip(frequencies,probabilities):
+      self.assertTrue(abs(f-p) < 0.01)
+
+    self.assertTrue(all(
+      s.sample_many(10,numpy.random.RandomState(1)) ==
+      s.sample_many(10,numpy.random.RandomState(1))))
@@ -0,0 +1,208 @@
+"""
+Render plots of dice distributions directly as SVG, without matplotlib. The
+plots mirror the layout of the matplotlib plots in plots.py.
+"""
+from django.http import HttpResponse
+
+from dice_probability import timing
+from dice_probability.die import BOX_PERCENTILES
+
+from xml.sax.saxutils import escape
+import math
+import string
+
+WIDTH = 1200
+HEIGHT = 600
+
+COLORS = ['#0000ff', '#008000', '#ff0000', '#00bfbf', '#bf00bf', '#bfbf00',
+          '#000000']
+
+def _ticks(lo,hi,count=8):
+  """Get evenly spaced, round tick values covering [lo, hi]."""
+  if hi <= lo:
+    hi = lo + 1.0
+  raw = float(hi-lo)/count
+  magnitude = 10**math.floor(math.log10(raw))
+  for step in (1, 2, 2.5, 5, 10):
+    if step*magnitude >= raw:
+      break
+  step *= magnitude
+
+  first = math.floor(lo/step)
+  last = math.ceil(hi/step)
+  return [ i*step for i in range(int(first),int(last)+1) ]
+
+def _label(value):
+  """Format a tick value without needless decimals."""
+  return ('%f'%value).rstrip('0').rstrip('.')
+
+class Axes(object):
+  """A rectangle of the image with data coordinates, like a matplotlib Axes."""
+
+  def __init__(self,rect,xticks,yticks):
+    """
+    Arguments:
+      rect:     The (left, bottom, width, height) of the axes as fractions of
+                the image, as for matplotlib.
+      xticks:   Tick values on the x axis, the first and last are the limits.
+      yticks:   Tick values on the y axis, the first and last are the limits.
+    """
+    (left,bottom,width,height) = rect
+    self.left = left*WIDTH
+    self.right = (left+width)*WIDTH
+    self.top = (1.0-bottom-height)*HEIGHT
+    self.bottom = (1.0-bottom)*HEIGHT
+    self.xticks = xticks
+    self.yticks = yticks
+    self.elements = []
+
+  def x(self,value):
+    (lo,hi) = (self.xticks[0],self.xticks[-1])
+    return self.left + (value-lo)*(self.right-self.left)/(hi-lo)
+
+  def y(self,value):
+    (lo,hi) = (self.yticks[0],self.yticks[-1])
+    return self.bottom - (value-lo)*(self.bottom-self.top)/(hi-lo)
+
+  def add(self,element):
+    self.elements.append(element)
+
+  def line(self,xs,ys,color,dashed=False):
+    """Draw a line through the given data points."""
+    points = string.join([ '%.2f,%.2f'%(self.x(x),self.y(y))
+                           for (x,y) in zip(xs,ys) ])
+    dash = ' stroke-dasharray="6,4"' if dashed else ''
+    self.add('<polyline points="%s" fill="none" stroke="%s"%s />'
+             %(points,color,dash))
+
+  def markers(self,xs,ys,color):
+    """Draw a circle at each of the given data points."""
+    for (x,y) in zip(xs,ys):
+      self.add('<circle cx="%.2f" cy="%.2f" r="3" fill="%s" />'
+               %(self.x(x),self.y(y),color))
+
+  def render(self,xlabel,ylabel=None,ylabels=None):
+    """Render the grid, frame, ticks, labels and content of the axes."""
+    parts = []
+    for t in self.xticks:
+      x = self.x(t)
+      parts.append(
+        '<line x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f" class="grid" />'
+        %(x,self.top,x,self.bottom))
+      parts.append('<text x="%.2f" y="%.2f" text-anchor="middle">%s</text>'
+                   %(x,self.bottom+16,_label(t)))
+    for (i,t) in enumerate(self.yticks):
+      y = self.y(t)
+      parts.append(
+        '<line x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f" class="grid" />'
+        %(self.left,y,self.right,y))
+      if ylabels is None:
+        label = _label(t)
+      elif 0 < i < len(self.yticks)-1:
+        label = escape(ylabels[i-1])
+      else:
+        continue
+      parts.append('<text x="%.2f" y="%.2f" text-anchor="end">%s</text>'
+                   %(self.left-6,y+4,label))
+
+    parts += self.elements
+
+    parts.append('<rect x="%.2f" y="%.2f" width="%.2f" height="%.2f" '
+                 'fill="none" stroke="#000000" />'
+                 %(self.left,self.top,self.right-self.left,
+                   self.bottom-self.top))
+    parts.append('<text x="%.2f" y="%.2f" text-anchor="middle">%s</text>'
+                 %((self.left+self.right)/2,HEIGHT-4,escape(xlabel)))
+    if ylabel is not None:
+      parts.append(
+        '<text x="14" y="%.2f" text-anchor="middle" '
+        'transform="rotate(-90 14 %.2f)">%s</text>'
+        %((self.top+self.bottom)/2,(self.top+self.bottom)/2,escape(ylabel)))
+    return parts
+
+def _document(parts):
+  """Wrap rendered parts in an SVG document."""
+  return string.join([
+    '<?xml version="1.0" encoding="utf-8"?>',
+    '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+    'width="%d" height="%d" viewBox="0 0 %d %d">'%(WIDTH,HEIGHT,WIDTH,HEIGHT),
+    '<style>text { font-family: sans-serif; font-size: 12px; } '
+    '.grid { stroke: #000000; stroke-opacity: 0.2; stroke-dasharray: 2,2; }'
+    '</style>',
+    '<rect width="100%" height="100%" fill="#ffffff" />',
+  ] + parts + ['</svg>'], '\n')
+
+def _response(parts):
+  return HttpResponse(_document(parts), content_type='image/svg+xml')
+
+def render_prob(dice,target=False):
+  """Render the probability, or reach if target, of each die as SVG."""
+  curves = []
+  for d in dice:
+    if target:
+      result = list(d.die.probability_reach_array(padded=True))
+    else:
+      result = list(d.die.probability_array()) + [0.0]
+    curves.append(result)
+
+  xmax = max([ len(c)-1 for c in curves ] + [1])
+  ymax = max([ max(c) for c in curves ] + [0.0])
+  ax = Axes((0.07,0.07,0.77,0.91), _ticks(0,xmax), _ticks(0.0,ymax or 1.0))
+
+  legend = []
+  for (i,(d,c)) in enumerate(zip(dice,curves)):
+    color = COLORS[i%len(COLORS)]
+    xs = range(len(c))
+    ax.line(xs,c,color)
+    ax.markers(xs,c,color)
+
+    y = HEIGHT/2 - 10*len(dice) + 20*i
+    legend.append(
+      '<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="%s" />'
+      %(ax.right+14,y,ax.right+34,y,color))
+    legend.append('<text x="%d" y="%d">%s</text>'
+                  %(ax.right+40,y+4,escape(d.pri)))
+
+  xlabel = 'Target Sum' if target else 'Sum'
+  return ax.render(xlabel,ylabel='Probability') + legend
+
+def render_box(dice):
+  """Render a horizontal box plot of the percentiles of each die as SVG."""
+  try:
+    boxes = [ d.die.percentile_reach(BOX_PERCENTILES) for d in reversed(dice) ]
+  except ValueError:
+    boxes = []
+
+  xmax = max([ b[-1] for b in boxes ] + [1])
+  xmin = min([ b[0] for b in boxes ] + [0])
+  ax = Axes((0.08,0.07,0.91,0.91), _ticks(xmin,xmax),
+            range(len(boxes)+2))
+
+  for (pos,(wisk_lo,q1,med,q3,wisk_hi)) in enumerate(boxes,1):
+    width = 0.5 if len(boxes)==1 else min(0.15*(len(boxes)-1),0.5)
+    (lo,hi) = (pos-width*0.5,pos+width*0.5)
+    (cap_lo,cap_hi) = (pos-width*0.25,pos+width*0.25)
+
+    ax.line([q1,wisk_lo],[pos,pos],'#0000ff',dashed=True)
+    ax.line([q3,wisk_hi],[pos,pos],'#0000ff',dashed=True)
+    ax.line([wisk_hi,wisk_hi],[cap_lo,cap_hi],'#000000')
+    ax.line([wisk_lo,wisk_lo],[cap_lo,cap_hi],'#000000')
+    ax.line([q1,q1,q3,q3,q1],[lo,hi,hi,lo,lo],'#0000ff')
+    ax.line([med,med],[lo,hi],'#ff0000')
+
+  labels = [ d.pri for d in reversed(dice) ]
+  return ax.render('Sum',ylabels=labels)
+
+@timing.timed('plot')
+def plot_prob(dice,target=False):
+  """Plot the probability, or reach if target, of each die as SVG."""
+  return _response(render_prob(dice,target))
+
+@timing.timed('plot')
+def plot_box(dice):
+  """Plot the percentiles of each die as an SVG box plot."""
+  return _response(render_box(dice))
+
+def inline(parts):
+  """Get an SVG document to embed directly in an HTML page."""
+  return _document(parts).split('\n',1)[1]
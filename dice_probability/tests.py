@@ -10,3 +10,11 @@ from django.test import TestCase
 from dice_probability.die_test import *
 from dice_probability.queue_test import *
 from dice_probability.doc_test import *
+from dice_probability.convolution_test import *
+from dice_probability.cache_test import *
+from dice_probability.sampler_test import *
+from dice_probability.views_test import *
+from dice_probability.api_test import *
+from dice_probability.render_test import *
+from dice_probability.benchmark_test import *
+from dice_probability.timing_test import *
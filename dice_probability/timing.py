@@ -0,0 +1,166 @@
+"""
+Measure how long each phase of a request takes, such as parsing, collapsing
+dice, rendering templates and plots, and count the convolutions done.
+
+TimingMiddleware records the phases of each request, reports them in a
+Server-Timing header and adds them to the process wide totals in stats.
+Outside of a request, phase() and count() do nothing.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+import timeit
+
+class Timings(object):
+  """Durations of the phases and counters of a single request."""
+
+  def __init__(self):
+    self.start = timeit.default_timer()
+    # Name to (calls, seconds), in order of first use.
+    self.phases = {}
+    self.order = []
+    # Name to (calls, total size).
+    self.counters = {}
+
+  def add_phase(self,name,seconds,calls=1):
+    if name not in self.phases:
+      self.order.append(name)
+      self.phases[name] = (0,0.0)
+    (c,s) = self.phases[name]
+    self.phases[name] = (c+calls,s+seconds)
+
+  def add_count(self,name,size,calls=1):
+    (c,s) = self.counters.get(name,(0,0))
+    self.counters[name] = (c+calls,s+size)
+
+  def merge(self,data):
+    """Add the phases and counters from data(), such as from another process."""
+    for (name,(calls,seconds)) in data['phases']:
+      self.add_phase(name,seconds,calls)
+    for (name,(calls,size)) in data['counters']:
+      self.add_count(name,size,calls)
+
+  def data(self):
+    """Get the phases and counters as picklable lists."""
+    return {
+      'phases': [ (name,self.phases[name]) for name in self.order ],
+      'counters': sorted(self.counters.items()),
+    }
+
+  def total(self):
+    """Seconds since the timings started."""
+    return timeit.default_timer() - self.start
+
+  def header(self):
+    """Format the timings as the value of a Server-Timing header."""
+    metrics = [ '%s;dur=%.3f'%(name,1000*self.phases[name][1])
+                for name in self.order ]
+    metrics += [ '%s;desc="%d calls, %d sides"'%(name,calls,size)
+                 for (name,(calls,size)) in sorted(self.counters.items()) ]
+    metrics.append('total;dur=%.3f'%(1000*self.total()))
+    return ', '.join(metrics)
+
+_local = local()
+
+def start():
+  """Start timing the current thread, returns the timings."""
+  _local.timings = Timings()
+  return _local.timings
+
+def finish():
+  """Stop timing the current thread, returns the timings or None."""
+  timings = current()
+  _local.timings = None
+  return timings
+
+def current():
+  """Get the timings of the current thread, None if not timing."""
+  return getattr(_local,'timings',None)
+
+@contextmanager
+def phase(name):
+  """Time the enclosed code as the named phase. Phases may be nested."""
+  timings = current()
+  if timings is None:
+    yield
+    return
+
+  begin = timeit.default_timer()
+  try:
+    yield
+  finally:
+    timings.add_phase(name,timeit.default_timer()-begin)
+
+def timed(name):
+  """Decorator timing each call of a function as the named phase."""
+  def decorator(func):
+    @wraps(func)
+    def wrapper(*args,**kwargs):
+      with phase(name):
+        return func(*args,**kwargs)
+    return wrapper
+  return decorator
+
+def count(name,size=0):
+  """Count a call, such as a convolution, with the size of its result."""
+  timings = current()
+  if timings is not None:
+    timings.add_count(name,size)
+
+class Stats(object):
+  """Process wide totals of the timings of all requests."""
+
+  def __init__(self):
+    self._lock = Lock()
+    self.clear()
+
+  def clear(self):
+    self.requests = 0
+    self.total = Timings()
+    self.max_phase = {}
+
+  def add(self,timings,seconds):
+    """Add the timings of a request that took seconds in total."""
+    with self._lock:
+      self.requests += 1
+      self.total.merge(timings.data())
+      self.total.add_phase('total',seconds)
+      durations = [ (name,timings.phases[name][1]) for name in timings.order ]
+      for (name,s) in durations + [('total',seconds)]:
+        self.max_phase[name] = max(self.max_phase.get(name,0.0),s)
+
+  def data(self):
+    """Get the totals, ready to be encoded as JSON."""
+    with self._lock:
+      phases = {}
+      for name in self.total.order:
+        (calls,seconds) = self.total.phases[name]
+        phases[name] = {
+          'calls': calls,
+          'seconds': seconds,
+          'mean': seconds/self.requests,
+          'max': self.max_phase[name],
+        }
+      counters = dict(
+        (name,{'calls': calls, 'size': size})
+        for (name,(calls,size)) in self.total.counters.items())
+      return {
+        'requests': self.requests,
+        'phases': phases,
+        'counters': counters,
+      }
+
+stats = Stats()
+
+class TimingMiddleware(object):
+  """Time each request and report the phases in a Server-Timing header."""
+
+  def process_request(self,request):
+    start()
+
+  def process_response(self,request,response):
+    timings = finish()
+    if timings is not None:
+      stats.add(timings,timings.total())
+      response['Server-Timing'] = timings.header()
+    return response
@@ -0,0 +1,52 @@
+from dice_probability import timing
+from dice_probability.die import Die
+from django.test import TestCase
+
+import json
+
+class TestTiming(TestCase):
+  def tearDown(self):
+    timing.finish()
+
+  def test_phases(self):
+    with timing.phase('parse'):
+      timing.count('convolve',7)
+    self.assertEquals(timing.current(),None)
+
+    timings = timing.start()
+    for i in range(2):
+      with timing.phase('parse'):
+        Die(6) + Die(6)
+    with timing.phase('collapse'):
+      pass
+    self.assertTrue(timing.finish() is timings)
+
+    self.assertEquals(timings.order,['parse','collapse'])
+    self.assertEquals(timings.phases['parse'][0],2)
+    self.assertEquals(timings.counters['convolve'],(2,22))
+
+    header = timings.header()
+    self.assertTrue(header.startswith('parse;dur='))
+    self.assertTrue('convolve;desc="2 calls, 22 sides"' in header)
+    self.assertTrue('total;dur=' in header)
+
+  def test_merge(self):
+    a = timing.Timings()
+    a.add_phase('plot',1.0)
+    a.add_count('convolve',10)
+    b = timing.Timings()
+    b.add_phase('plot',0.5)
+    b.merge(a.data())
+    self.assertEquals(b.phases['plot'],(2,1.5))
+    self.assertEquals(b.counters['convolve'],(1,10))
+
+  def test_request(self):
+    timing.stats.clear()
+    response = self.client.get('/',{'mode':'vs','0-die':'3d6','1-die':'2d8'})
+    self.assertTrue('versus;dur=' in response['Server-Timing'])
+    self.assertTrue('template;dur=' in response['Server-Timing'])
+
+    data = json.loads(self.client.get('/api/stats/').content)
+    self.assertEquals(data['requests'],1)
+    self.assertEquals(data['phases']['versus']['calls'],1)
+    self.assertTrue('parse' in data['caches'])
@@ -1,22 +1,38 @@
 from django import forms
+from django.core.cache import get_cache
 from django.http import HttpResponse
-from django.shortcuts import render
+from django import shortcuts
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
 
 from dice_probability.die import LazyDie as Die
 from dice_probability.die import DieParseException, from_string, pool_from_string
+from dice_probability.die import versus_matrix
 from dice_probability.formmanager import manager_factory
+from dice_probability import render as plot_render
+from dice_probability import svg
+from dice_probability import timing
 
+from datetime import datetime
+import hashlib
 import string
+import time
 import urllib
 
-from matplotlib import use as matplot_use
-matplot_use('cairo')
-
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.pyplot import Axes
-from dice_probability.boxplot import manual_boxplot
-from pylab import yticks
+def render(request,template,context):
+  """Render a template, timed as the template phase of the request."""
+  with timing.phase('template'):
+    return shortcuts.render(request,template,context)
+
+def render_plot(query,name,*args):
+  """
+  Render a plot with the named plot function, as SVG if the query has
+  format=svg and otherwise as PNG through matplotlib. PNG plots are rendered
+  in the render pool, see dice_probability.render.
+  """
+  if query.get('format') == 'svg':
+    return getattr(svg,name)(*args)
+  return plot_render.pool().render('dice_probability.plots',name,*args)
 
 MAX_DICE = 10
 MAX_SIDES = 30
@@ -75,8 +91,105 @@ class PoolDieForm(forms.Form):
 def probability_reference(request):
   return _probability_reference(request, stage='html')
 
+# Bump to invalidate rendered plots when the rendering changes.
+PLOT_CACHE_VERSION = 2
+
+def plot_cache():
+  """The Django cache holding rendered plots, the 'plots' cache alias."""
+  return get_cache('plots')
+
+def canonical_query(query):
+  """
+  Get a canonical signature of the dice described by the query: the mode,
+  the dice pools and the canonical description of each custom die in the
+  order they are shown. Queries describing the same dice, such as 3d6 and
+  d6 2d6, get the same signature. Invalid input, and dice without a
+  canonical description, are kept as given, with whitespace normalized.
+  """
+  mode = query.get('mode','target')
+
+  poolform = PoolDieForm(query)
+  if poolform.is_valid():
+    pools = tuple(poolform.rawdice)
+  else:
+    pools = string.join(query.get('dice_pools','').split())
+
+  dice = []
+  for f in CustomDieFormManager(query).base_forms():
+    canonical = None
+    if f.is_valid() and f.cleaned_data['die'] is not None:
+      canonical = f.cleaned_data['die'].canonical()
+    if canonical is None:
+      canonical = string.join((f['die'].value() or '').split())
+    dice.append(canonical)
+
+  return (mode, pools, tuple(dice))
+
+def canonical_getvars(query):
+  """
+  Encode the canonical signature of the query as GET parameters, so that
+  equivalent pages link to the same plot URL and share browser caches.
+  """
+  (mode,pools,dice) = canonical_query(query)
+  if type(pools) is tuple:
+    pools = string.join(pools)
+
+  getvars = [ ('mode',mode), ('dice_pools',pools) ]
+  getvars += [ ('%d-die'%i,d) for (i,d) in enumerate(dice) ]
+  if query.get('format') == 'svg':
+    getvars.append(('format','svg'))
+  return urllib.urlencode([ (k,v.encode('utf-8')) for (k,v) in getvars ])
+
+def plot_key(query):
+  """Get the cache key for the plot described by the query."""
+  raw = repr((PLOT_CACHE_VERSION, query.get('format') == 'svg',
+              canonical_query(query)))
+  return 'plot-%s'%hashlib.sha1(raw).hexdigest()
+
+_PLOT_MODES = ('plot_target','plot_prob','plot_box')
+
+def _plot_etag(request):
+  # Only cached plots are known to be images, probability_reference_plot()
+  # adds the ETag to plots it renders.
+  if request.GET.get('mode') not in _PLOT_MODES:
+    return None
+  key = plot_key(request.GET)
+  if plot_cache().get(key) is None:
+    return None
+  return key
+
+def _plot_last_modified(request):
+  if request.GET.get('mode') not in _PLOT_MODES:
+    return None
+  cached = plot_cache().get(plot_key(request.GET))
+  if cached is None:
+    return None
+  return datetime.utcfromtimestamp(cached[1])
+
+@condition(etag_func=_plot_etag, last_modified_func=_plot_last_modified)
 def probability_reference_plot(request):
-  return _probability_reference(request, stage='plot')
+  key = plot_key(request.GET)
+  cache = plot_cache()
+
+  cached = cache.get(key)
+  if cached is None:
+    try:
+      response = _probability_reference(request, stage='plot')
+    except plot_render.RenderUnavailable as e:
+      response = HttpResponse(e.args[0], content_type='text/plain', status=503)
+      response['Retry-After'] = '10'
+      return response
+    content_type = response['Content-Type']
+    if response.status_code != 200 or not content_type.startswith('image/'):
+      return response
+    cached = (response.content, int(time.time()), content_type)
+    cache.set(key, cached)
+
+  (content,modified,content_type) = cached
+  response = HttpResponse(content, content_type=content_type)
+  response['Last-Modified'] = http_date(modified)
+  response['ETag'] = quote_etag(key)
+  return response
 
 CustomDieFormManager = manager_factory(CustomDieForm,max_forms=10)
 
@@ -99,7 +212,7 @@ def _probability_reference(request, stage):
   if mode == 'target':
     dice = build_dice(customdiemanager,poolform)
     # Compute probability for each die.
-    result = transpose([ d.die.probability_reach() for d in dice ])
+    result = transpose([ d.die.probability_reach_array() for d in dice ])
 
     return render(request, 'target.html', {
       'dice': dice,
@@ -111,7 +224,10 @@ def _probability_reference(request, stage):
 
   elif mode == 'vs':
     dice = build_dice(customdiemanager,poolform)
-    result = [ [ a.die.probability_vs(b.die) for a in dice ] for b in dice ]
+    # Row b, column a holds the probability that a beats b.
+    with timing.phase('versus'):
+      (win,tie,loss) = versus_matrix([ d.die for d in dice ])
+    result = [ list(row) for row in loss ]
 
     return render(request, 'versus.html', {
       'dice': dice,
@@ -123,41 +239,62 @@ def _probability_reference(request, stage):
   elif mode == 'plot_target':
     if stage=='plot':
       dice = build_dice(customdiemanager,poolform)
-      return plot_prob(dice,target=True)
+      return render_plot(request.GET,'plot_prob',dice,True)
     else:
-      getvars = urllib.urlencode(request.GET)
+      getvars = canonical_getvars(request.GET)
+
+      # With format=svg the plot is inlined in the page.
+      inline = None
+      if request.GET.get('format') == 'svg':
+        dice = build_dice(customdiemanager,poolform)
+        inline = svg.inline(svg.render_prob(dice,target=True))
 
       return render(request, 'plot_target.html', {
         'modeform': modeform,
         'customdiemanager': customdiemanager,
         'poolform': poolform,
         'getvars': getvars,
+        'svg': inline,
       })
   elif mode == 'plot_prob':
     if stage=='plot':
       dice = build_dice(customdiemanager,poolform)
-      return plot_prob(dice,target=False)
+      return render_plot(request.GET,'plot_prob',dice,False)
     else:
-      getvars = urllib.urlencode(request.GET)
+      getvars = canonical_getvars(request.GET)
+
+      # With format=svg the plot is inlined in the page.
+      inline = None
+      if request.GET.get('format') == 'svg':
+        dice = build_dice(customdiemanager,poolform)
+        inline = svg.inline(svg.render_prob(dice,target=False))
 
       return render(request, 'plot_prob.html', {
         'modeform': modeform,
         'customdiemanager': customdiemanager,
         'poolform': poolform,
         'getvars': getvars,
+        'svg': inline,
       })
   elif mode == 'plot_box':
     if stage=='plot':
       dice = build_dice(customdiemanager,poolform)
-      return plot_box(dice)
+      return render_plot(request.GET,'plot_box',dice)
     else:
-      getvars = urllib.urlencode(request.GET)
+      getvars = canonical_getvars(request.GET)
+
+      # With format=svg the plot is inlined in the page.
+      inline = None
+      if request.GET.get('format') == 'svg':
+        dice = build_dice(customdiemanager,poolform)
+        inline = svg.inline(svg.render_box(dice))
 
       return render(request, 'plot_box.html', {
         'modeform': modeform,
         'customdiemanager': customdiemanager,
         'poolform': poolform,
         'getvars': getvars,
+        'svg': inline,
       })
   else:
     return render(request, 'probability_reference.html', {
@@ -173,8 +310,11 @@ class DieInfo(object):
     self.details = details
 
 def build_dice(customdiemanager,poolform):
+  with timing.phase('parse'):
+    valid = customdiemanager.is_valid() and poolform.is_valid()
+
   dice = []
-  if customdiemanager.is_valid() and poolform.is_valid():
+  if valid:
     # Create the corresponding dice for each form.
     dice += [
       DieInfo(
@@ -202,60 +342,3 @@ def transpose(data):
     return map(lambda x: [x],*data)
   else:
     return map(None,*data)
-
-def plot_prob(dice,target=False):
-  fig = Figure(figsize=(12, 6),frameon=False)
-  ax = Axes(fig,[0.07, 0.07, 0.77, 0.91])
-  fig.add_axes(ax)
-
-  for d in dice:
-    if target:
-      result = d.die.probability_reach()+[0.0]
-    else:
-      result = d.die.probability()+[0.0]
-
-    ax.plot(result,'-o',label=d.pri)
-  
-  ax.set_ylabel('Probability')
-  if target:
-    ax.set_xlabel('Target Sum')
-  else:
-    ax.set_xlabel('Sum')
-  ax.grid(True)
-
-  if dice:
-    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-
-  canvas = FigureCanvas(fig)
-  response = HttpResponse(content_type='image/png')
-  canvas.print_png(response)
-  return response
-
-_BOX_PERCENTILES = [0.95, 0.75, 0.5, 0.25, 0.05]
-
-def plot_box(dice):
-  fig = Figure(figsize=(12, 6),frameon=False)
-  ax = Axes(fig,[0.08, 0.07, 0.91, 0.91])
-  fig.add_axes(ax)
-
-  try:
-    boxes = [ d.die.percentile_reach(_BOX_PERCENTILES) for d in reversed(dice) ]
-  except ValueError:
-    boxes = []
-
-  if boxes:
-    manual_boxplot(ax, boxes, vert=0)
-  else:
-    ax.plot([])
-
-  ax.set_yticklabels([ d.pri for d in reversed(dice) ])
-
-  ax.set_xlabel('Sum')
-
-  ax.grid(True)
-
-  canvas = FigureCanvas(fig)
-  response = HttpResponse(content_type='image/png')
-  canvas.print_png(response)
-  return response
-
@@ -0,0 +1,107 @@
+from django.test import TestCase
+from django.utils.http import http_date
+
+from dice_probability import render
+from dice_probability.views import canonical_getvars, plot_cache, plot_key
+
+import os
+import subprocess
+import sys
+
+class TestViews(TestCase):
+  def setUp(self):
+    plot_cache().clear()
+
+  def test_lazy_plots(self):
+    # Importing the views must not pull in matplotlib, only plotting does.
+    code = (
+      "import sys\n"
+      "import dice_probability.views, dice_probability.api\n"
+      "loaded = [ m for m in ('matplotlib','pylab','dice_probability.plots')\n"
+      "           if m in sys.modules ]\n"
+      "sys.stdout.write(','.join(loaded))\n")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + sys.path)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    self.assertEquals(output,'')
+
+  def test_svg(self):
+    queries = [
+      {'0-die':'3d6 d4-d12','dice_pools':'1-5'},
+      {'0-die':'d6'},
+      {'0-die':'d4','1-die':'d2'},
+      {},
+    ]
+    for query in queries:
+      query['format'] = 'svg'
+      for mode in ('plot_target','plot_prob','plot_box'):
+        query['mode'] = mode
+        response = self.client.get('/plot.png',query)
+        self.assertEquals(response.status_code,200)
+        self.assertEquals(response['Content-Type'],'image/svg+xml')
+        self.assertTrue(response.content.startswith('<?xml'))
+        self.assertTrue('<svg' in response.content)
+
+        response = self.client.get('/',query)
+        self.assertEquals(response.status_code,200)
+        self.assertTrue('<svg' in response.content)
+        self.assertFalse('<img' in response.content)
+
+  def test_plot_cache(self):
+    query = {'mode':'plot_prob','0-die':'3d6','dice_pools':'1-5',
+             'format':'svg'}
+    response = self.client.get('/plot.png',query)
+    self.assertEquals(response.status_code,200)
+    self.assertTrue('plot;' in response['Server-Timing'])
+    etag = response['ETag']
+    modified = response['Last-Modified']
+
+    # Equivalent dice are served from the cache, without rendering.
+    query['0-die'] = 'd6 2d6'
+    cached = self.client.get('/plot.png',query)
+    self.assertEquals(cached.status_code,200)
+    self.assertFalse('plot;' in cached['Server-Timing'],cached['Server-Timing'])
+    self.assertEquals(cached.content,response.content)
+    self.assertEquals(cached['ETag'],etag)
+    self.assertEquals(cached['Last-Modified'],modified)
+
+    response = self.client.get('/plot.png',query,HTTP_IF_NONE_MATCH=etag)
+    self.assertEquals(response.status_code,304)
+    response = self.client.get('/plot.png',query,
+      HTTP_IF_MODIFIED_SINCE=http_date())
+    self.assertEquals(response.status_code,304)
+    response = self.client.get('/plot.png',query,
+      HTTP_IF_MODIFIED_SINCE=http_date(0))
+    self.assertEquals(response.status_code,200)
+
+  def test_plot_not_cached(self):
+    # Pages served by the plot URL are not cached.
+    query = {'mode':'target','0-die':'3d6'}
+    response = self.client.get('/plot.png',query)
+    self.assertEquals(response.status_code,200)
+    self.assertFalse(response.has_header('ETag'))
+    self.assertEquals(plot_cache().get(plot_key(query)),None)
+
+    # Nor are plots that could not be rendered.
+    query['mode'] = 'plot_prob'
+    pool = render._pool
+    render._pool = render.RenderPool(0,0,10)
+    try:
+      response = self.client.get('/plot.png',query)
+    finally:
+      render._pool = pool
+    self.assertEquals(response.status_code,503)
+    self.assertFalse(response.has_header('ETag'))
+    self.assertEquals(plot_cache().get(plot_key(query)),None)
+
+  def test_canonical_getvars(self):
+    query = {'mode':'plot_prob','0-die':'d6 2d6','dice_pools':'1-2'}
+    self.assertEquals(canonical_getvars(query),
+      'mode=plot_prob&dice_pools=1+2&0-die=3d6')
+
+    # Dice without exact weights have no canonical description.
+    query['0-die'] = ' [9999999999999999999,1] '
+    self.assertEquals(canonical_getvars(query),
+      'mode=plot_prob&dice_pools=1+2&0-die=%5B9999999999999999999%2C1%5D')
+    self.assertEquals(self.client.get('/',query).status_code,200)